@@ -7,8 +7,10 @@ ensuring smooth operations. The key features include:
 
 1. **Order Management**:
    - `OrderAdmin`: Enables viewing, approving, and rejecting orders.
-   - Automatically updates user profiles with approved study hours.
-   - Sends email notifications to students upon order approval, informing them of their updated study hours.
+   - Automatically updates user profiles with approved study hours and the denormalized order state
+     (completed flag, pending orders and hours) in the same transaction as the status change.
+   - Queues notifications to students upon order approval; they are sent as one digest email per student
+     with their updated study hours (see api/notifications.py).
    - Custom actions like bulk approval or rejection of pending orders streamline management.
 
 2. **Active User Tracking**:
@@ -18,13 +20,22 @@ ensuring smooth operations. The key features include:
    - `UserProfileAdmin`: Allows administrators to view and edit user study hours directly from the admin list view.
    - Ensures easy monitoring and quick adjustments to user profiles.
 
-4. **Reservation Management**:
+4. **Search**:
+   - Order and reservation searches use the `SearchToken` word-prefix index rather than `icontains` scans.
+
+5. **Reservation Management**:
    - `ReservationAdmin`: Handles student reservations with options to approve or reject them.
    - Automatically deducts study hours from users' profiles upon approval, ensuring accurate hour tracking.
+   - Queues a notification per approved lesson for the students' digest emails.
    - Includes error handling for cases where users lack sufficient hours or a valid user profile.
 
-5. **Custom Actions**:
+6. **Slow Queries**:
+   - `slow_queries_view`: Staff page with the slowest query fingerprints by total time and the latest slow queries.
+
+7. **Custom Actions**:
    - Tailored actions ensure only eligible records are processed (e.g., pending orders or unapproved reservations).
+   - Actions are wrapped with `profile_action`, so a sample of runs can be profiled when profiling is enabled.
+   - Actions and changelists declare query budgets (`query_budget`, `query_budgets`), checked by `api/tests.py`.
    - Informative messages are displayed for successful and unsuccessful actions, enhancing admin efficiency.
 
 This admin configuration centralizes control over orders, user profiles, and reservations, 
@@ -33,105 +44,191 @@ providing a robust and user-friendly interface for administrators.
 
 
 from django.contrib import admin
-from .models import ActiveUser, UserProfile, Reservation, Order
-from django.core.mail import send_mail
+from .models import ActiveUser, UserProfile, Reservation, ReservationTombstone, Order, SearchToken
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .summary import invalidate_reservation_summary
+from .notifications import record_notifications
+from .profiling import profile_action
+from .querybudget import query_budget
+from .slowqueries import recent_slow_queries, top_offenders
+from django.template.response import TemplateResponse
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('student', 'first_name', 'last_name', 'email', 'hours', 'status', 'created_at')
+    list_select_related = ('student',)
+    query_budgets = {'changelist': 5, 'delete_selected': 16}  # Changelist and Django's own actions
     list_filter = ('created_at', 'status')
     search_fields = ('student__username', 'first_name', 'last_name', 'email')
     actions = ['approve_orders', 'reject_orders']  
 
+    # Search through the SearchToken index (word prefixes) instead of icontains over joined columns
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return SearchToken.filter_queryset(queryset, 'order', search_term), False
+
     @admin.action(description='Approve selected orders')
+    @query_budget(11)
+    @profile_action
     def approve_orders(self, request, queryset):
-        for order in queryset:
-            if order.status == 'pending':  
-                order.status = 'approved'
-                order.save()
-
-                # Updating study hours in UserProfile
-                user_profile, created = UserProfile.objects.get_or_create(user=order.student)
-                user_profile.study_hours += order.hours 
-                user_profile.order_completed = True
-                user_profile.save()
-
-                # Send confirmation email to the student
-                subject = "Confirmation of Your Study Hour Order"
-                message = (
-                    f"Dear {order.student.first_name},\n\n"
-                    f"We are pleased to inform you that your order for {order.hours} study hours has been successfully approved. "
-                    f"You now have {user_profile.study_hours} available study hours in your account.\n\n"
-                    f"We wish you great success in your studies!\n\n"
-                    f"Best regards,\n"
-                    f"The RedBlue Academy Team"
-                )
-                try:
-                    send_mail(
-                        subject,
-                        message,
-                        'info@redblueacademy.com',  # From email
-                        [order.student.email],  # To email
-                        fail_silently=False,
-                    )
-                    self.message_user(request, f"A confirmation email has been sent to the student. {order.student.username}.")
-                except Exception as e:
-                    self.message_user(
-                        request,
-                        f"Error sending email to student {order.student.username}: {str(e)}",
-                        level="error"
-                    )
-                
-                self.message_user(request, f"Order for {order.student.username} has been approved and hours added.")
+        with transaction.atomic():
+            # Lock the pending orders so a concurrent approval cannot credit the same hours twice
+            orders = list(queryset.filter(status='pending').select_related('student').select_for_update())
+            Order.objects.filter(id__in=[order.id for order in orders]).update(status='approved', approved=True)
+
+            # Updating study hours, order_completed and the pending counters in UserProfile
+            UserProfile.release_pending_orders([(order.student_id, order.hours) for order in orders], approved=True)
+
+            # Confirmation emails are queued and sent as one digest per student by `flush_notifications`
+            record_notifications('order_approved', [(order.student_id, {'hours': order.hours}) for order in orders])
+
+        for order in orders:
+            self.message_user(request, f"Order for {order.student.username} has been approved and hours added.")
+        if orders:
+            students = len({order.student_id for order in orders})
+            self.message_user(request, f"Confirmation emails to {students} student(s) have been queued.")
 
     @admin.action(description='Reject selected orders')
+    @query_budget(10)
+    @profile_action
     def reject_orders(self, request, queryset):
-        updated = queryset.filter(status='pending').update(status='rejected')
+        with transaction.atomic():
+            rejected = list(queryset.filter(status='pending').select_for_update().values_list('id', 'student_id', 'hours'))
+            updated = Order.objects.filter(id__in=[row[0] for row in rejected]).update(status='rejected', approved=False)
+            UserProfile.release_pending_orders([(student_id, hours) for _, student_id, hours in rejected])
         self.message_user(request, f"{updated} orders have been rejected.")
 
+    # Status edits and deletions outside the actions rebuild the affected students' order state
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            UserProfile.recompute_order_state([obj.student_id])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            UserProfile.recompute_order_state([obj.student_id])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            student_ids = list(queryset.values_list('student_id', flat=True).distinct())
+            super().delete_queryset(request, queryset)
+            UserProfile.recompute_order_state(student_ids)
+
 # Registering the ActiveUser model in the admin interface
 @admin.register(ActiveUser)
 class ActiveUserAdmin(admin.ModelAdmin):
     list_display = ('user', 'last_login')  # Displays the user and the last login time
+    list_select_related = ('user',)
+    query_budgets = {'changelist': 5, 'delete_selected': 10}  # Changelist and Django's own actions
 
 # Registering the UserProfile model in the admin interface
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'study_hours')  # Displays the user and available study hours
+    list_display = ('user', 'study_hours', 'order_completed', 'pending_hours')  # Displays the user, available and pending study hours
+    list_select_related = ('user',)
+    query_budgets = {'changelist': 5, 'delete_selected': 10}  # Changelist and Django's own actions
     list_editable = ('study_hours',)  # Allows editing of study hours directly in the list view
+    # Maintained transactionally by the order paths (or `repair_profile_flags`) and by the feed token view
+    readonly_fields = ('order_completed', 'pending_orders', 'pending_hours', 'email_normalized', 'calendar_token')
 
 # Registering the Reservation model in the admin interface with additional customization
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
     list_display = ('student', 'start_time', 'end_time', 'status', 'created_at')  # Displays reservation details
+    list_select_related = ('student',)
+    query_budgets = {'changelist': 5, 'delete_selected': 14}  # Changelist and Django's own actions
     list_filter = ('status', 'start_time')  # Adds filters for status and start time in the admin panel
     search_fields = ('student__username',)  # Enables search by student's username
     actions = ['approve_reservations', 'reject_reservations']  # Adds custom actions for reservations
 
+    # Search through the SearchToken index (word prefixes) instead of icontains over the joined user table
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return SearchToken.filter_queryset(queryset, 'reservation', search_term), False
+
     # Custom action to approve selected reservations
     @admin.action(description='Approve selected reservations')
+    @query_budget(11)
+    @profile_action
     def approve_reservations(self, request, queryset):
-        for reservation in queryset:
-            if reservation.status != 'approved':  # Check if the reservation is not already approved
-                try:
-                    user_profile = UserProfile.objects.get(user=reservation.student)  # Get user profile
-                    if user_profile.study_hours > 0:
-                        # If user has enough study hours, approve reservation and deduct one hour
-                        reservation.status = 'approved'
-                        reservation.save()
-                        user_profile.study_hours -= 1
-                        user_profile.save()
-                        self.message_user(request, f"Reservation approved and hours deducted for {reservation.student.username}.")
-                    else:
-                        # Display an error message if study hours are insufficient
-                        self.message_user(request, f"{reservation.student.username} does not have enough study hours.", level="error")
-                except UserProfile.DoesNotExist:
+        with transaction.atomic():
+            # Lock the reservations not approved yet and their students' profiles, each fetched with one query
+            reservations = list(queryset.exclude(status='approved').select_related('student').select_for_update())
+            profiles = UserProfile.objects.select_for_update().in_bulk(
+                {reservation.student_id for reservation in reservations}, field_name='user_id'
+            )
+            approved = []
+            for reservation in reservations:
+                user_profile = profiles.get(reservation.student_id)
+                if user_profile is None:
                     # Handle case where the user profile does not exist
                     self.message_user(request, f"UserProfile not found for {reservation.student.username}.", level="error")
+                elif user_profile.study_hours > 0:
+                    # If user has enough study hours, approve reservation and deduct one hour
+                    approved.append(reservation)
+                    user_profile.study_hours -= 1
+                    self.message_user(request, f"Reservation approved and hours deducted for {reservation.student.username}.")
+                else:
+                    # Display an error message if study hours are insufficient
+                    self.message_user(request, f"{reservation.student.username} does not have enough study hours.", level="error")
+
+            # `update()` bypasses auto_now; delta syncs rely on updated_at
+            Reservation.objects.filter(id__in=[reservation.id for reservation in approved]).update(
+                status='approved', updated_at=timezone.now()
+            )
+            UserProfile.objects.bulk_update(profiles.values(), ['study_hours'])
+            record_notifications('reservation_approved', [
+                (reservation.student_id, {'start_time': reservation.start_time.isoformat()}) for reservation in approved
+            ])
+        transaction.on_commit(invalidate_reservation_summary)
 
     # Custom action to reject selected reservations
     @admin.action(description='Reject selected reservations')
+    @query_budget(6)
+    @profile_action
     def reject_reservations(self, request, queryset):
-        queryset.update(status='rejected')  # Update the status of selected reservations to 'rejected'
-
-
+        queryset.update(status='rejected', updated_at=timezone.now())  # Update the status of selected reservations to 'rejected'
+        transaction.on_commit(invalidate_reservation_summary)
+
+    # Edits from the admin change form invalidate the cached staff summary. A reservation moved to another
+    # student is logged as a tombstone for the previous one, whose delta sync and calendar feed lose it.
+    def save_model(self, request, obj, form, change):
+        previous = form.initial.get('student') if change else None
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if previous is not None and previous != obj.student_id:
+                ReservationTombstone.record([(obj.pk, previous)], 'deleted')
+        transaction.on_commit(invalidate_reservation_summary)
+
+    # Deletions from the admin are logged as tombstones for the students' delta sync
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            ReservationTombstone.record([(obj.pk, obj.student_id)], 'deleted')
+            super().delete_model(request, obj)
+        transaction.on_commit(invalidate_reservation_summary)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            rows = list(queryset.values_list('id', 'student_id'))
+            ReservationTombstone.record(rows, 'deleted')
+            super().delete_queryset(request, queryset)
+        transaction.on_commit(invalidate_reservation_summary)
+
+
+# Staff page of the slow-query ring buffer (see api/slowqueries.py), routed at /admin/slow-queries/
+def slow_queries_view(request):
+    entries = recent_slow_queries()
+    context = {
+        **admin.site.each_context(request),
+        "title": "Slow queries",
+        "enabled": settings.SLOW_QUERY_ENABLED,
+        "threshold_ms": settings.SLOW_QUERY_THRESHOLD_MS,
+        "top": top_offenders(entries),
+        "entries": entries,
+    }
+    return TemplateResponse(request, "admin/api/slow_queries.html", context)
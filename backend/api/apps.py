@@ -1,7 +1,8 @@
 # backend/api/apps.py
 
 '''
-Configuration for the API app in Django, setting default auto field and app name.
+Configuration for the API app in Django, setting default auto field and app name, and registering the
+app's system checks.
 '''
 
 from django.apps import AppConfig
@@ -11,4 +12,7 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
 
+    def ready(self):
+        from . import checks  # noqa: F401 (registers the system checks)
+
  
@@ -0,0 +1,125 @@
+# backend/api/calendar_feed.py
+
+'''
+Per-student iCalendar (ICS) subscription feed of reservations:
+1. Each student's feed is addressed by the secret `UserProfile.calendar_token`, so calendar apps can
+   subscribe without sending credentials.
+2. Every student has a feed version: the time of the last change to their reservations, read from the
+   database together with the token lookup (newest `updated_at` and newest `ReservationTombstone`, two
+   probes of the per-student indexes). Every worker and command sees the same version without any cache
+   invalidation. The version is the feed's ETag and Last-Modified, so conditional polls are answered
+   with 304 without rendering. A write whose transaction commits after a newer one shows up with the
+   student's next change.
+3. `stream_feed` renders the feed row by row from a database iterator, so long histories are never
+   built in memory. Feeds up to `CALENDAR_FEED_CACHE_MAX_BYTES` are also kept in the cache under the
+   current version and served from there until the student's reservations change.
+'''
+
+import secrets
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from django.utils.http import http_date
+
+from .models import Reservation, ReservationTombstone, UserProfile
+
+FEED_STATUSES = {"pending": "TENTATIVE", "approved": "CONFIRMED"}  # Reservation status -> VEVENT STATUS
+CACHE_TIMEOUT = 24 * 60 * 60
+ICS_DATETIME = "%Y%m%dT%H%M%SZ"
+
+
+def _to_ns(moment):
+    return int(moment.timestamp()) * 1_000_000_000 + moment.microsecond * 1_000
+
+
+def get_feed(token):
+    # (user_id, version) of the feed addressed by `token` in one query, or None for an unknown token.
+    # The version is the nanosecond timestamp of the student's last reservation change (0 when none).
+    changed = Reservation.objects.filter(student_id=OuterRef("user_id")).order_by("-updated_at").values("updated_at")[:1]
+    removed = (
+        ReservationTombstone.objects.filter(student_id=OuterRef("user_id")).order_by("-created_at").values("created_at")[:1]
+    )
+    row = (
+        UserProfile.objects.filter(calendar_token=token)
+        .annotate(changed=Subquery(changed), removed=Subquery(removed))
+        .values_list("user_id", "changed", "removed")
+        .first()
+    )
+    if row is None:
+        return None
+    user_id, *moments = row
+    return user_id, max((_to_ns(moment) for moment in moments if moment is not None), default=0)
+
+
+def feed_etag(user_id, version):
+    return f'"{user_id}-{version}"'
+
+
+def feed_last_modified(version):
+    return http_date(version // 1_000_000_000)
+
+
+def get_or_create_calendar_token(user, rotate=False):
+    profile, _ = UserProfile.objects.get_or_create(user=user)
+    if profile.calendar_token is None or rotate:
+        profile.calendar_token = secrets.token_urlsafe(32)
+        profile.save(update_fields=["calendar_token"])
+    return profile.calendar_token
+
+
+def feed_cache_key(user_id, version):
+    return f"calendar_feed:{user_id}:{version}"
+
+
+def get_cached_feed(user_id, version):
+    return cache.get(feed_cache_key(user_id, version))
+
+
+def _format(moment):
+    return moment.astimezone(dt_timezone.utc).strftime(ICS_DATETIME)
+
+
+def stream_feed(user_id, version):
+    # Yields the feed event by event; a small enough feed is cached under `version` once fully rendered
+    max_bytes = getattr(settings, "CALENDAR_FEED_CACHE_MAX_BYTES", 512 * 1024)
+    chunks, size = [], 0
+
+    def emit(*lines):
+        nonlocal size
+        data = "".join(line + "\r\n" for line in lines).encode()
+        size += len(data)
+        if size <= max_bytes:
+            chunks.append(data)
+        return data
+
+    yield emit(
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//RedBlue Academy//Lessons//EN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:RedBlue Academy lessons",
+    )
+    reservations = (
+        Reservation.objects
+        .filter(student_id=user_id, status__in=FEED_STATUSES, hidden_for_student=False)
+        .order_by("start_time")
+        .values_list("id", "start_time", "end_time", "status", "updated_at")
+    )
+    for pk, start_time, end_time, status, updated_at in reservations.iterator(chunk_size=500):
+        yield emit(
+            "BEGIN:VEVENT",
+            f"UID:reservation-{pk}@redblueacademy.com",
+            f"DTSTAMP:{_format(updated_at)}",
+            f"DTSTART:{_format(start_time)}",
+            f"DTEND:{_format(end_time)}",
+            "SUMMARY:RedBlue Academy lesson" + (" (pending approval)" if status == "pending" else ""),
+            f"STATUS:{FEED_STATUSES[status]}",
+            "END:VEVENT",
+        )
+    yield emit("END:VCALENDAR")
+
+    if size <= max_bytes:
+        cache.set(feed_cache_key(user_id, version), b"".join(chunks), CACHE_TIMEOUT)
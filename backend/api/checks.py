@@ -0,0 +1,29 @@
+# backend/api/checks.py
+
+'''
+System checks run by `manage.py` commands and the development server:
+1. `check_shared_cache`: Warns (`api.W001`) when the default cache is per-process locmem outside the test
+   suite. Throttle buckets, idempotency keys and the slow-query buffer are then kept per worker, so every
+   worker enforces its own limits and sees only its own entries.
+'''
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend not in LOCAL_CACHE_BACKENDS or getattr(settings, "TESTING", False):
+        return []
+    return [Warning(
+        "The default cache is not shared between processes, so each worker has its own throttle buckets, "
+        "idempotency keys and slow-query buffer.",
+        hint="Set CACHE_URL to a Redis server, e.g. redis://127.0.0.1:6379/1.",
+        id="api.W001",
+    )]
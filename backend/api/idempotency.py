@@ -0,0 +1,147 @@
+# backend/api/idempotency.py
+
+'''
+Idempotency support for retried POST requests:
+1. `idempotent`: Decorator for API views honouring the `Idempotency-Key` request header.
+2. The first response for a key is stored in the cache and in `IdempotencyKey` (DB fallback),
+   and replayed on retries without running the view again.
+3. Concurrent duplicates are serialized by the unique constraint on (user, endpoint, key):
+   only the request that inserts the row runs the view, the others get 409 until it finishes.
+   A claim unfinished after `IDEMPOTENCY_PROCESSING_TIMEOUT` seconds (its worker was killed) is taken
+   over by the next retry. The claim's `created_at` is its lease: a request only finishes or releases
+   the row while it still holds the lease, so a takeover is never overwritten.
+4. Keys expire after `IDEMPOTENCY_KEY_TTL` seconds; expired rows are evicted lazily and by
+   the `purge_idempotency_keys` management command.
+'''
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+DEFAULT_TTL = 24 * 60 * 60  # One day
+DEFAULT_PROCESSING_TIMEOUT = 60
+
+
+def get_ttl():
+    return getattr(settings, "IDEMPOTENCY_KEY_TTL", DEFAULT_TTL)
+
+
+def get_processing_timeout():
+    return getattr(settings, "IDEMPOTENCY_PROCESSING_TIMEOUT", DEFAULT_PROCESSING_TIMEOUT)
+
+
+def _cache_key(user_id, endpoint, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f"idempotency:{user_id}:{endpoint}:{digest}"
+
+
+def _replay(record):
+    # Rebuilds the stored response; record is a dict with status_code, body and request_hash
+    response = Response(record["body"], status=record["status_code"])
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _conflict(message):
+    return Response({"error": message}, status=status.HTTP_409_CONFLICT)
+
+
+def idempotent(view_func):
+    # Must be applied below `@api_view`, so the wrapped view receives a DRF request
+    endpoint = view_func.__name__
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"error": f"{IDEMPOTENCY_HEADER} must be at most 255 characters."}, status=status.HTTP_400_BAD_REQUEST)
+
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        cache_key = _cache_key(request.user.pk, endpoint, key)
+        ttl = get_ttl()
+
+        # Fast path: a completed response is cached
+        record = cache.get(cache_key)
+        if record is not None:
+            if record["request_hash"] != request_hash:
+                return Response({"error": f"{IDEMPOTENCY_HEADER} was already used with a different request body."}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return _replay(record)
+
+        # Claim the key; the unique constraint lets exactly one concurrent request win
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    claim = IdempotencyKey.objects.create(
+                        user=request.user, endpoint=endpoint, key=key, request_hash=request_hash
+                    )
+                break
+            except IntegrityError:
+                existing = IdempotencyKey.objects.filter(user=request.user, endpoint=endpoint, key=key).first()
+                if existing is None:
+                    continue  # Evicted in the meantime, try to claim again
+                if existing.created_at < timezone.now() - timedelta(seconds=ttl):
+                    existing.delete()
+                    continue
+                if existing.request_hash != request_hash:
+                    return Response({"error": f"{IDEMPOTENCY_HEADER} was already used with a different request body."}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                if existing.status_code is None:
+                    if existing.created_at >= timezone.now() - timedelta(seconds=get_processing_timeout()):
+                        return _conflict("A request with this idempotency key is still being processed.")
+                    # Abandoned claim: renew its lease, exactly one concurrent retry succeeds
+                    now = timezone.now()
+                    if IdempotencyKey.objects.filter(
+                        pk=existing.pk, created_at=existing.created_at, status_code__isnull=True
+                    ).update(created_at=now):
+                        claim, claim.created_at = existing, now
+                        break
+                    continue
+                record = {"status_code": existing.status_code, "body": existing.response_body, "request_hash": existing.request_hash}
+                cache.set(cache_key, record, ttl)
+                return _replay(record)
+        else:
+            return _conflict("A request with this idempotency key is still being processed.")
+
+        # The claim as long as this request holds its lease
+        owned = IdempotencyKey.objects.filter(pk=claim.pk, created_at=claim.created_at)
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            owned.delete()
+            raise
+
+        if response.status_code >= 500:
+            # Server errors are not stored so the client can retry them
+            owned.delete()
+            return response
+
+        body = json.loads(JSONRenderer().render(response.data) or b"null")
+        if owned.update(status_code=response.status_code, response_body=body):
+            cache.set(cache_key, {"status_code": response.status_code, "body": body, "request_hash": request_hash}, ttl)
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000):
+    # Deletes expired keys in bounded batches and returns how many were removed
+    cutoff = timezone.now() - timedelta(seconds=get_ttl())
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,130 @@
+# backend/api/management/commands/expire_reservations.py
+
+'''
+Moves past-due pending reservations (and optionally stale pending orders) to the "expired" status.
+
+Rows are processed in bounded batches: each batch is one index range scan on
+(status, start_time) / (status, created_at) followed by a single UPDATE, so the runtime
+grows with the number of expired rows rather than the size of the tables.
+
+Run it once from cron:
+    python manage.py expire_reservations --orders-older-than 30 --notify
+or keep it running in a loop:
+    python manage.py expire_reservations --loop 300
+
+Each run also purges reservation tombstones older than the delta-sync retention window.
+'''
+
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mass_mail
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Order, Reservation, ReservationTombstone, UserProfile
+from api.summary import invalidate_reservation_summary
+
+
+def expire_in_batches(queryset, order_field, batch_size, touch_updated_at=False, on_expired=None):
+    # Expires the pending rows of `queryset` batch by batch; returns a Counter of expired rows per student.
+    # `on_expired(ids)` runs in each batch's transaction, e.g. to keep denormalized counters in sync.
+    expired = Counter()
+    while True:
+        with transaction.atomic():
+            # Locked so rows cannot be approved or rejected between the SELECT and the UPDATE
+            batch = list(queryset.select_for_update().order_by(order_field).values_list("id", "student_id")[:batch_size])
+            if not batch:
+                return expired
+            ids = [row[0] for row in batch]
+            changes = {"status": "expired"}
+            if touch_updated_at:
+                changes["updated_at"] = timezone.now()  # `update()` bypasses auto_now; delta syncs rely on it
+            queryset.model.objects.filter(id__in=ids).update(**changes)
+            if on_expired is not None:
+                on_expired(ids)
+        expired.update(row[1] for row in batch)
+        if len(batch) < batch_size:
+            return expired
+
+
+def release_expired_orders(ids):
+    UserProfile.release_pending_orders(Order.objects.filter(id__in=ids).values_list("student_id", "hours"))
+
+
+def build_notifications(expired_reservations, expired_orders):
+    # One email per affected student, summarizing everything that expired in this run
+    student_ids = set(expired_reservations) | set(expired_orders)
+    messages = []
+    for user in User.objects.filter(id__in=student_ids).exclude(email="").only("id", "first_name", "email"):
+        lines = []
+        if expired_reservations[user.id]:
+            lines.append(f"- {expired_reservations[user.id]} pending lesson reservation(s) whose start time has passed")
+        if expired_orders[user.id]:
+            lines.append(f"- {expired_orders[user.id]} pending study hour order(s) that were not paid in time")
+        message = (
+            f"Dear {user.first_name},\n\n"
+            "The following requests in your account have expired:\n"
+            + "\n".join(lines)
+            + "\n\nYou can book new lessons or place a new order at any time.\n\n"
+            "Best regards,\n"
+            "The RedBlue Academy Team"
+        )
+        messages.append(("Your pending requests have expired", message, settings.DEFAULT_FROM_EMAIL, [user.email]))
+    return messages
+
+
+class Command(BaseCommand):
+    help = "Expire past-due pending reservations and, optionally, stale pending orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows updated per UPDATE statement.")
+        parser.add_argument("--orders-older-than", type=int, default=None, metavar="DAYS",
+                            help="Also expire pending orders created more than DAYS days ago.")
+        parser.add_argument("--notify", action="store_true", help="Email affected students a summary.")
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS",
+                            help="Keep running, sleeping SECONDS between runs (0 runs once).")
+
+    def handle(self, *args, **options):
+        while True:
+            self.run_once(options)
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
+
+    def run_once(self, options):
+        now = timezone.now()
+        batch_size = options["batch_size"]
+
+        expired_reservations = expire_in_batches(
+            Reservation.objects.filter(status="pending", start_time__lt=now), "start_time", batch_size,
+            touch_updated_at=True,
+        )
+        expired_orders = Counter()
+        if options["orders_older_than"] is not None:
+            cutoff = now - timedelta(days=options["orders_older_than"])
+            expired_orders = expire_in_batches(
+                Order.objects.filter(status="pending", created_at__lt=cutoff), "created_at", batch_size,
+                on_expired=release_expired_orders,
+            )
+
+        if expired_reservations:
+            invalidate_reservation_summary()
+
+        # Tombstones past the retention window are no longer needed by any valid sync token
+        ReservationTombstone.objects.filter(created_at__lt=now - ReservationTombstone.RETENTION).delete()
+
+        if options["notify"]:
+            messages = build_notifications(expired_reservations, expired_orders)
+            try:
+                send_mass_mail(messages, fail_silently=False)  # One SMTP connection for all messages
+            except Exception as e:
+                self.stderr.write(f"Error sending expiry notifications: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {sum(expired_reservations.values())} reservations and {sum(expired_orders.values())} orders."
+        ))
@@ -0,0 +1,44 @@
+# backend/api/management/commands/flush_notifications.py
+
+'''
+Sends the queued student notifications as one digest email per student (see api/notifications.py).
+
+Run it from cron:
+    python manage.py flush_notifications
+or keep it running in a loop:
+    python manage.py flush_notifications --loop 60
+
+A student's events are held until the oldest is `NOTIFICATION_DIGEST_WINDOW` seconds old, so events
+recorded in the meantime (e.g. by the same bulk approval) end up in the same email. `--window 0`
+sends everything that is queued.
+'''
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.notifications import flush_notifications
+
+
+class Command(BaseCommand):
+    help = "Send queued student notifications as coalesced digest emails."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", type=int, default=None, metavar="SECONDS",
+                            help="Coalescing window (default: NOTIFICATION_DIGEST_WINDOW).")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Emails per batch (default: NOTIFICATION_BATCH_SIZE).")
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS",
+                            help="Keep running, sleeping SECONDS between runs (0 runs once).")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent = flush_notifications(window=options["window"], batch_size=options["batch_size"])
+                self.stdout.write(self.style.SUCCESS(f"Sent {sent} notification digests."))
+            except Exception as e:
+                # The unsent events stay queued for the next run
+                self.stderr.write(f"Error sending notification digests: {e}")
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
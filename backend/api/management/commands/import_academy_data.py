@@ -0,0 +1,240 @@
+# backend/api/management/commands/import_academy_data.py
+
+'''
+Bulk import of students, orders and reservations from another system:
+
+    python manage.py import_academy_data users.csv --kind users
+    python manage.py import_academy_data orders.ndjson --kind orders --batch-size 5000
+
+Input is streamed from CSV (with a header row) or NDJSON, one record per row:
+- users: username, password, email, first_name, last_name, study_hours
+  (plain-text passwords are hashed in a process pool; values that already look like a Django hash
+  are kept; an empty password makes the account unusable until reset). Hashing dominates large
+  imports: Django's default PBKDF2 costs about 0.3 s per password per core, so import existing
+  hashes where the source system has compatible ones.
+- orders: username, first_name, last_name, email, phone, address, hours, status
+- reservations: username, start_time, end_time, status
+
+Each batch is written with `bulk_create` inside one transaction. Usernames are resolved to ids through
+an in-memory map filled with one query per batch. After every committed batch the number of processed
+records is written to a checkpoint file, so a failed import continues where it stopped when re-run.
+'''
+
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import django
+from django.apps import apps as django_apps
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from api.models import Order, Reservation, SearchToken, UserProfile, normalize_email
+from api.summary import invalidate_reservation_summary
+
+
+def _init_worker():
+    # Workers started with "spawn" (macOS, Windows) need their own Django setup to read the hashers
+    if not django_apps.ready:
+        django.setup()
+
+
+def hash_password(password):
+    if not password:
+        return make_password(None)  # Unusable password
+    try:
+        identify_hasher(password)
+        return password  # Already a Django password hash
+    except ValueError:
+        return make_password(password)
+
+
+def read_records(path, fmt):
+    with open(path, newline="", encoding="utf-8") as handle:
+        if fmt == "csv":
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = "Stream users, orders or reservations from CSV/NDJSON into the database in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or NDJSON file to import.")
+        parser.add_argument("--kind", required=True, choices=["users", "orders", "reservations"])
+        parser.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Records per transaction.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="Processes hashing passwords (0 hashes in this process).")
+        parser.add_argument("--checkpoint", help="Progress file (default: <path>.checkpoint).")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist.")
+        fmt = options["format"] or ("csv" if path.suffix.lower() == ".csv" else "ndjson")
+        checkpoint = Path(options["checkpoint"] or f"{path}.checkpoint")
+        done = int(checkpoint.read_text()) if checkpoint.exists() else 0
+        if done:
+            self.stdout.write(f"Resuming after {done} records.")
+
+        self.user_ids = {}
+        self.pool = ProcessPoolExecutor(options["workers"], initializer=_init_worker) if options["workers"] else None
+        import_batch = getattr(self, f"import_{options['kind']}")
+        records = islice(read_records(path, fmt), done, None)
+        started = time.monotonic()
+        imported = 0
+        try:
+            while True:
+                batch = list(islice(records, options["batch_size"]))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    imported += import_batch(batch)
+                done += len(batch)
+                self.write_checkpoint(checkpoint, done)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+
+        if options["kind"] == "reservations" and imported:
+            invalidate_reservation_summary()
+        checkpoint.unlink(missing_ok=True)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} {options['kind']} in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f}/s)."
+        ))
+
+    def write_checkpoint(self, checkpoint, done):
+        # Replaced atomically so a crash never leaves a truncated checkpoint
+        tmp = checkpoint.with_name(checkpoint.name + ".tmp")
+        tmp.write_text(str(done))
+        os.replace(tmp, checkpoint)
+
+    def resolve_users(self, usernames):
+        # Fills the username -> id map for the usernames not seen yet, with one query
+        usernames = set(usernames)
+        missing = usernames - self.user_ids.keys()
+        if missing:
+            self.user_ids.update(User.objects.filter(username__in=missing).values_list("username", "id"))
+        unknown = usernames - self.user_ids.keys()
+        if unknown:
+            raise CommandError(f"Unknown usernames: {', '.join(sorted(unknown)[:10])}")
+
+    def import_users(self, batch):
+        # Existing usernames are skipped, so re-importing the same file is harmless
+        usernames = [record["username"] for record in batch]
+        seen = set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+        unique_batch = []
+        for record in batch:
+            if record["username"] not in seen:
+                seen.add(record["username"])
+                unique_batch.append(record)
+        batch = unique_batch
+        if not batch:
+            return 0
+
+        passwords = [record.get("password") or "" for record in batch]
+        if self.pool is not None:
+            hashes = list(self.pool.map(hash_password, passwords, chunksize=max(1, len(passwords) // 32)))
+        else:
+            hashes = [hash_password(password) for password in passwords]
+
+        users = User.objects.bulk_create([
+            User(
+                username=record["username"],
+                password=password_hash,
+                email=record.get("email") or "",
+                first_name=record.get("first_name") or "",
+                last_name=record.get("last_name") or "",
+            )
+            for record, password_hash in zip(batch, hashes)
+        ])
+        if users[0].pk is None:
+            # Backends without RETURNING (MySQL) don't set primary keys on bulk_create
+            self.user_ids.update(User.objects.filter(username__in=[u.username for u in users]).values_list("username", "id"))
+        else:
+            self.user_ids.update((user.username, user.pk) for user in users)
+
+        # The first user with an email keeps it in the unique normalized email index
+        emails = {normalize_email(record.get("email")) for record in batch} - {None}
+        taken = set(UserProfile.objects.filter(email_normalized__in=emails).values_list("email_normalized", flat=True))
+        profiles = []
+        for record in batch:
+            email = normalize_email(record.get("email"))
+            if email in taken:
+                email = None
+            elif email is not None:
+                taken.add(email)
+            profiles.append(UserProfile(
+                user_id=self.user_ids[record["username"]],
+                study_hours=int(record.get("study_hours") or 0),
+                email_normalized=email,
+            ))
+        UserProfile.objects.bulk_create(profiles)
+        return len(users)
+
+    def import_orders(self, batch):
+        self.resolve_users(record["username"] for record in batch)
+        last_id = self.last_id(Order)
+        orders = Order.objects.bulk_create([
+            Order(
+                student_id=self.user_ids[record["username"]],
+                first_name=record.get("first_name") or "",
+                last_name=record.get("last_name") or "",
+                email=record.get("email") or "",
+                phone=record.get("phone") or "",
+                address=record.get("address") or "",
+                hours=int(record["hours"]),
+                status=record.get("status") or "pending",
+                approved=record.get("status") == "approved",
+                terms_accepted=True,
+                gdpr_accepted=True,
+            )
+            for record in batch
+        ])
+        # Keep the denormalized order state on UserProfile in sync with the new orders
+        student_ids = list({self.user_ids[record["username"]] for record in batch})
+        UserProfile.recompute_order_state(student_ids)
+        self.index_search_tokens("order", Order, orders, last_id)
+        return len(batch)
+
+    def import_reservations(self, batch):
+        self.resolve_users(record["username"] for record in batch)
+        last_id = self.last_id(Reservation)
+        reservations = Reservation.objects.bulk_create([
+            Reservation(
+                student_id=self.user_ids[record["username"]],
+                start_time=parse_datetime(record["start_time"]),
+                end_time=parse_datetime(record["end_time"]),
+                status=record.get("status") or "pending",
+            )
+            for record in batch
+        ])
+        self.index_search_tokens("reservation", Reservation, reservations, last_id)
+        return len(batch)
+
+    def last_id(self, model):
+        # Highest existing id, only needed to find the batch's rows on backends without RETURNING (MySQL)
+        if connection.features.can_return_rows_from_bulk_insert:
+            return None
+        return model.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+
+    def index_search_tokens(self, kind, model, created, last_id):
+        # `bulk_create` bypasses `save()`, so the rows of this batch (and only those) are indexed here
+        if last_id is None:
+            rows = model.objects.filter(id__in=[obj.pk for obj in created])
+        else:
+            rows = model.objects.filter(id__gt=last_id, student_id__in={obj.student_id for obj in created})
+        SearchToken.index(kind, rows.select_related("student"))
@@ -0,0 +1,39 @@
+# backend/api/management/commands/profile_summary.py
+
+'''
+Summarizes the profiles collected by the profiling middleware and admin action decorator:
+the hottest frames across all (or the matching) `.prof` files in `PROFILING_DIR`.
+
+    python manage.py profile_summary --match create_order --sort tottime --limit 30
+'''
+
+import io
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import get_profile_dir
+
+
+class Command(BaseCommand):
+    help = "Show the hottest frames aggregated over collected profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--match", default="", help="Only include profiles whose file name contains this text.")
+        parser.add_argument("--sort", default="cumulative", choices=["cumulative", "tottime", "ncalls"],
+                            help="Sort order of the frames.")
+        parser.add_argument("--limit", type=int, default=25, help="Number of frames to show.")
+        parser.add_argument("--callers", action="store_true", help="Also show who called the listed frames.")
+
+    def handle(self, *args, **options):
+        files = sorted(str(path) for path in get_profile_dir().glob("*.prof") if options["match"] in path.name)
+        if not files:
+            raise CommandError(f"No profiles found in {get_profile_dir()}.")
+
+        output = io.StringIO()  # pstats writes fragments; collect them before handing them to self.stdout
+        stats = pstats.Stats(*files, stream=output)
+        stats.strip_dirs().sort_stats(options["sort"]).print_stats(options["limit"])
+        if options["callers"]:
+            stats.print_callers(options["limit"])
+        self.stdout.write(f"Aggregated {len(files)} profiles")
+        self.stdout.write(output.getvalue())
@@ -0,0 +1,20 @@
+# backend/api/management/commands/purge_idempotency_keys.py
+
+'''
+Deletes stored idempotency keys older than `IDEMPOTENCY_KEY_TTL`. Intended to be run from cron.
+'''
+
+from django.core.management.base import BaseCommand
+
+from api.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Delete expired idempotency keys in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows deleted per DELETE statement.")
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
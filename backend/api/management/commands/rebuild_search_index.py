@@ -0,0 +1,35 @@
+# backend/api/management/commands/rebuild_search_index.py
+
+'''
+Rebuilds the SearchToken index of orders and reservations in batches, e.g. after usernames were
+changed or rows were written without going through `save()`. Tokens of deleted rows are dropped.
+'''
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Order, Reservation, SearchToken
+
+
+class Command(BaseCommand):
+    help = "Rebuild the admin search token index for orders and reservations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows indexed per transaction.")
+
+    def handle(self, *args, **options):
+        for kind, model in (("order", Order), ("reservation", Reservation)):
+            last_id = 0
+            indexed = 0
+            while True:
+                batch = list(model.objects.filter(id__gt=last_id).select_related("student").order_by("id")[:options["batch_size"]])
+                if not batch:
+                    break
+                with transaction.atomic():
+                    # Drop tokens of rows deleted within this id range, then re-index the batch
+                    SearchToken.objects.filter(kind=kind, object_id__gt=last_id, object_id__lte=batch[-1].id).delete()
+                    SearchToken.index(kind, batch)
+                last_id = batch[-1].id
+                indexed += len(batch)
+            SearchToken.objects.filter(kind=kind, object_id__gt=last_id).delete()
+            self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} {kind}s."))
@@ -0,0 +1,34 @@
+# backend/api/management/commands/repair_profile_flags.py
+
+'''
+Recomputes the order state denormalized on UserProfile (order_completed, pending_orders and
+pending_hours) from the orders, in batches of users. Use it after manual data fixes or to
+verify that the counters have not drifted.
+'''
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized order flags and pending counters on UserProfile."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Users recomputed per batch.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        repaired = 0
+        while True:
+            user_ids = list(User.objects.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size])
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            with transaction.atomic():
+                repaired += UserProfile.recompute_order_state(user_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Recomputed order state for {repaired} profiles."))
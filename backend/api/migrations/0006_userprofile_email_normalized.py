@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:38
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_email_normalized(apps, schema_editor):
+    # Copies every user's lower-cased email into UserProfile in batches, creating missing profiles.
+    # The first user (by id) keeps a case-insensitive duplicate; later ones are left unindexed.
+    User = apps.get_model('auth', 'User')
+    UserProfile = apps.get_model('api', 'UserProfile')
+
+    seen = set(UserProfile.objects.exclude(email_normalized=None).values_list('email_normalized', flat=True))
+    last_id = 0
+    while True:
+        users = list(
+            User.objects.filter(id__gt=last_id).exclude(email='')
+            .order_by('id').values_list('id', 'email')[:BATCH_SIZE]
+        )
+        if not users:
+            break
+        last_id = users[-1][0]
+
+        profiles = {p.user_id: p for p in UserProfile.objects.filter(user_id__in=[u[0] for u in users])}
+        to_update, to_create = [], []
+        for user_id, email in users:
+            normalized = email.strip().lower()
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            profile = profiles.get(user_id)
+            if profile is None:
+                to_create.append(UserProfile(user_id=user_id, email_normalized=normalized))
+            elif profile.email_normalized is None:
+                profile.email_normalized = normalized
+                to_update.append(profile)
+
+        UserProfile.objects.bulk_create(to_create)
+        UserProfile.objects.bulk_update(to_update, ['email_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_order_approved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='email_normalized',
+            field=models.CharField(blank=True, max_length=254, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_email_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_expired_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reservation_id', models.BigIntegerField()),
+                ('reason', models.CharField(choices=[('deleted', 'Deleted'), ('hidden', 'Hidden for student')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['student', 'updated_at'], name='reservation_student_upd_idx'),
+        ),
+        migrations.AddField(
+            model_name='reservationtombstone',
+            name='student',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='reservationtombstone',
+            index=models.Index(fields=['student', 'created_at'], name='tombstone_student_created_idx'),
+        ),
+    ]
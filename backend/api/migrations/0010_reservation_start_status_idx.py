@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_reservation_sync'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['start_time', 'status'], name='reservation_start_status_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:46
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+BATCH_SIZE = 1000
+
+
+def backfill_order_state(apps, schema_editor):
+    # Recomputes order_completed and the pending counters from the orders, in batches of users.
+    # Also aligns Order.approved with Order.status, which approval paths did not always keep in sync.
+    Order = apps.get_model('api', 'Order')
+    UserProfile = apps.get_model('api', 'UserProfile')
+
+    Order.objects.filter(status='approved', approved=False).update(approved=True)
+    Order.objects.exclude(status='approved').filter(approved=True).update(approved=False)
+
+    last_id = 0
+    while True:
+        user_ids = list(
+            Order.objects.filter(student_id__gt=last_id).order_by('student_id')
+            .values_list('student_id', flat=True).distinct()[:BATCH_SIZE]
+        )
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        stats = Order.objects.filter(student_id__in=user_ids).values('student_id').annotate(
+            completed=Count('id', filter=Q(status='approved')),
+            pending=Count('id', filter=Q(status='pending')),
+            hours=Sum('hours', filter=Q(status='pending')),
+        )
+        profiles = {p.user_id: p for p in UserProfile.objects.filter(user_id__in=user_ids)}
+        to_create, to_update = [], []
+        for row in stats:
+            profile = profiles.get(row['student_id'])
+            if profile is None:
+                profile = UserProfile(user_id=row['student_id'])
+                to_create.append(profile)
+            else:
+                to_update.append(profile)
+            profile.order_completed = row['completed'] > 0
+            profile.pending_orders = row['pending']
+            profile.pending_hours = row['hours'] or 0
+        UserProfile.objects.bulk_create(to_create)
+        UserProfile.objects.bulk_update(to_update, ['order_completed', 'pending_orders', 'pending_hours'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_reservation_start_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='pending_hours',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='pending_orders',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_order_state, migrations.RunPython.noop),
+    ]
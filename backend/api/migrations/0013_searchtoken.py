@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:50
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def tokens_of(*values):
+    # Frozen copy of api.models.search_tokens
+    tokens = set()
+    for value in values:
+        text = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode().lower()
+        tokens.update(token[:64] for token in re.split(r'[^a-z0-9]+', text) if token)
+    return tokens
+
+
+def backfill_search_tokens(apps, schema_editor):
+    # Indexes the existing orders and reservations in batches of primary keys
+    SearchToken = apps.get_model('api', 'SearchToken')
+    sources = [
+        ('order', apps.get_model('api', 'Order'), lambda o: (o.student.username, o.first_name, o.last_name, o.email)),
+        ('reservation', apps.get_model('api', 'Reservation'), lambda r: (r.student.username,)),
+    ]
+    for kind, model, values in sources:
+        last_id = 0
+        while True:
+            batch = list(model.objects.filter(id__gt=last_id).select_related('student').order_by('id')[:BATCH_SIZE])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            SearchToken.objects.bulk_create([
+                SearchToken(kind=kind, object_id=obj.id, token=token)
+                for obj in batch
+                for token in tokens_of(*values(obj))
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_work_queue_leases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('order', 'Order'), ('reservation', 'Reservation')], max_length=12)),
+                ('object_id', models.BigIntegerField()),
+                ('token', models.CharField(max_length=64)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'token', 'object_id'], name='searchtoken_lookup_idx'), models.Index(fields=['kind', 'object_id'], name='searchtoken_object_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_search_tokens, migrations.RunPython.noop),
+    ]
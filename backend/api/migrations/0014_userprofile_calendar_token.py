@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_searchtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='calendar_token',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -3,21 +3,83 @@
 '''
 Defines core models for the application:
 1. Order: Manages orders with fields for student info, study hours, status, and timestamps.
-2. UserProfile: Tracks study hours and order completion status per user.
-3. Reservation: Handles reservations with status updates, timing, and visibility settings.
+2. UserProfile: Tracks study hours, denormalized order state (completed, pending orders and hours), the normalized email
+   and the calendar feed token per user.
+3. Reservation: Handles reservations with status updates, timing, visibility settings, and a change timestamp.
 4. ActiveUser: Logs last login times for user activity tracking.
+5. ReservationTombstone: Logs deleted and hidden reservations for the incremental `?since=` sync.
+6. IdempotencyKey: Stores the first response to a keyed POST so client retries can be replayed.
+7. SearchToken: Word tokens of orders and reservations backing the indexed admin search.
+8. NotificationEvent: Student notifications waiting to be coalesced into one digest email per student.
+
+A `post_save` handler on User keeps `UserProfile.email_normalized` in sync with every email change.
 
 These models support key functionalities in reservations, user profiles, and order management.
 '''
 
+import re
+import unicodedata
+from datetime import timedelta
+
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 
-class Order(models.Model):
+
+def normalize_email(email):
+    # Lower-cased, trimmed form used for the unique email index (None when empty)
+    email = (email or '').strip().lower()
+    return email or None
+
+
+TOKEN_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'  # Characters of search tokens, in collation order
+
+
+def search_tokens(*values):
+    # Lower-cased, accent-free words of the given values, used as prefix-searchable index entries
+    tokens = set()
+    for value in values:
+        text = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode().lower()
+        tokens.update(token[:SearchToken.MAX_LENGTH] for token in re.split(r'[^a-z0-9]+', text) if token)
+    return tokens
+
+
+class SearchIndexedModel(models.Model):
+    # Keeps the model's SearchTokens current from `save()`: rows are indexed when inserted and re-indexed only
+    # when one of `SEARCH_FIELDS` changed since they were loaded, so status-only saves don't touch the index
+    SEARCH_KIND = None
+    SEARCH_FIELDS = ()
+
+    class Meta:
+        abstract = True
+
+    def _search_state(self):
+        # Read from __dict__, so deferred fields are not loaded just for the comparison
+        return tuple(self.__dict__.get(field) for field in self.SEARCH_FIELDS)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._indexed_state = instance._search_state()
+        return instance
+
+    def save(self, *args, **kwargs):
+        reindex = self._state.adding or self._search_state() != getattr(self, '_indexed_state', None)
+        super().save(*args, **kwargs)
+        if reindex:
+            SearchToken.index(self.SEARCH_KIND, [self])
+            self._indexed_state = self._search_state()
+
+
+class Order(SearchIndexedModel):
+    SEARCH_KIND = 'order'
+    SEARCH_FIELDS = ('student_id', 'first_name', 'last_name', 'email')
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
+        ('expired', 'Expired'),
     ]
 
     student = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -32,30 +94,150 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     approved = models.BooleanField(default=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending') 
+    claimed_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='claimed_orders')  # Staff working on it
+    claimed_until = models.DateTimeField(null=True, blank=True)  # Work queue lease expiry
 
     def __str__(self):
         return f"Order by {self.student.username} for {self.hours} hours"
 
-# Model representing a user profile with available study hours
+    def search_values(self):
+        return [self.student.username, self.first_name, self.last_name, self.email]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),  # Pending work queue and expiry
+        ]
+
+def _decrement(field, amount):
+    # `field - amount`, floored at zero without ever computing a negative (unsigned on MySQL) value
+    return models.Case(
+        models.When(**{f"{field}__gte": amount}, then=models.F(field) - amount),
+        default=models.Value(0),
+    )
+
+
+def _per_user(amounts):
+    # `CASE WHEN user_id = ... THEN <amount>` expression giving each user in `amounts` its own value
+    return models.Case(
+        *[models.When(user_id=user_id, then=models.Value(amount)) for user_id, amount in amounts.items()],
+        output_field=models.PositiveIntegerField(),
+    )
+
+
+# Model representing a user profile with available study hours and denormalized order state
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)  
     study_hours = models.PositiveIntegerField(default=0)
-    order_completed = models.BooleanField(default=False)  
+    order_completed = models.BooleanField(default=False)  # True once any order has been approved
+    pending_orders = models.PositiveIntegerField(default=0)  # Orders awaiting approval
+    pending_hours = models.PositiveIntegerField(default=0)  # Hours in orders awaiting approval
+    email_normalized = models.CharField(max_length=254, unique=True, null=True, blank=True)  # Indexed lookup for email uniqueness
+    calendar_token = models.CharField(max_length=64, unique=True, null=True, blank=True)  # Secret of the ICS feed URL
+
+    RELEASE_BATCH_SIZE = 500  # Students per UPDATE in `release_pending_orders`
 
     def __str__(self):
         return f"{self.user.username} - Available study hours: {self.study_hours}"  
 
+    @property
+    def order_pending(self):
+        # If there is an approved order but also a new "pending" order, the approved one takes priority
+        return self.pending_orders > 0 and not self.order_completed
+
+    @classmethod
+    def sync_email(cls, user):
+        # Sets email_normalized from the user's email, creating the profile if needed. An address already
+        # indexed for another user stays theirs and this entry is cleared, so a duplicate saved from the
+        # admin or the shell does not fail (`create_order` claims the address strictly instead).
+        email = normalize_email(user.email)
+        if email is not None and cls.objects.filter(email_normalized=email).exclude(user=user).exists():
+            email = None
+        if not cls.objects.filter(user=user).update(email_normalized=email) and email is not None:
+            cls.objects.create(user=user, email_normalized=email)
+
+    @classmethod
+    def add_pending_order(cls, user, hours):
+        # Called in the transaction that creates a pending order
+        profile, created = cls.objects.get_or_create(user=user)
+        cls.objects.filter(pk=profile.pk).update(
+            pending_orders=models.F('pending_orders') + 1,
+            pending_hours=models.F('pending_hours') + hours,
+        )
+
+    @classmethod
+    def release_pending_orders(cls, orders, approved=False):
+        # Called in the transaction that moves orders out of "pending"; `orders` holds (student_id, hours) pairs.
+        # Approved orders also credit their hours and mark the order as completed. One UPDATE per
+        # RELEASE_BATCH_SIZE students, with the per-student amounts as CASE expressions.
+        totals = {}
+        for student_id, hours in orders:
+            count, total_hours = totals.get(student_id, (0, 0))
+            totals[student_id] = (count + 1, total_hours + hours)
+        if not totals:
+            return
+
+        existing = set(cls.objects.filter(user_id__in=totals).values_list('user_id', flat=True))
+        cls.objects.bulk_create([cls(user_id=student_id) for student_id in totals if student_id not in existing])
+
+        student_ids = list(totals)
+        for start in range(0, len(student_ids), cls.RELEASE_BATCH_SIZE):
+            batch = student_ids[start:start + cls.RELEASE_BATCH_SIZE]
+            total_hours = _per_user({student_id: totals[student_id][1] for student_id in batch})
+            changes = {
+                'pending_orders': _decrement('pending_orders', _per_user({student_id: totals[student_id][0] for student_id in batch})),
+                'pending_hours': _decrement('pending_hours', total_hours),
+            }
+            if approved:
+                changes['study_hours'] = models.F('study_hours') + total_hours
+                changes['order_completed'] = True
+            cls.objects.filter(user_id__in=batch).update(**changes)
+
+    @classmethod
+    def recompute_order_state(cls, user_ids):
+        # Rebuilds order_completed and the pending counters of the given users from their orders
+        stats = {
+            row['student_id']: row
+            for row in Order.objects.filter(student_id__in=user_ids).values('student_id').annotate(
+                completed=models.Count('id', filter=models.Q(status='approved')),
+                pending=models.Count('id', filter=models.Q(status='pending')),
+                hours=models.Sum('hours', filter=models.Q(status='pending')),
+            )
+        }
+        profiles = {profile.user_id: profile for profile in cls.objects.filter(user_id__in=user_ids)}
+
+        to_create, to_update = [], []
+        for user_id in set(user_ids):
+            row = stats.get(user_id)
+            profile = profiles.get(user_id)
+            if profile is None:
+                if row is None:
+                    continue  # No orders and no profile: nothing to store
+                profile = cls(user_id=user_id)
+                to_create.append(profile)
+            else:
+                to_update.append(profile)
+            profile.order_completed = bool(row and row['completed'])
+            profile.pending_orders = row['pending'] if row else 0
+            profile.pending_hours = (row['hours'] or 0) if row else 0
+
+        cls.objects.bulk_create(to_create)
+        cls.objects.bulk_update(to_update, ['order_completed', 'pending_orders', 'pending_hours'])
+        return len(to_create) + len(to_update)
+
     class Meta:
         verbose_name = "Student hour"  # Singular name for the model in Django Admin
         verbose_name_plural = "Student hours"  # Plural name for the model in Django Admin
 
 
 # Model representing a reservation with a status and timestamps
-class Reservation(models.Model):
+class Reservation(SearchIndexedModel):
+    SEARCH_KIND = 'reservation'
+    SEARCH_FIELDS = ('student_id',)  # Search tokens only depend on the student
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
+        ('expired', 'Expired'),
     ]
 
     student = models.ForeignKey(User, on_delete=models.CASCADE)  # The user making the reservation
@@ -64,10 +246,55 @@ class Reservation(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')  # Status of the reservation
     created_at = models.DateTimeField(auto_now_add=True)  # Timestamp of when the reservation was created
     hidden_for_student = models.BooleanField(default=False)  # Visibility flag for the student
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Last change, used by the `?since=` delta sync
+    claimed_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='claimed_reservations')  # Staff working on it
+    claimed_until = models.DateTimeField(null=True, blank=True)  # Work queue lease expiry
 
     def __str__(self):
         return f"{self.student.username} - {self.start_time} ({self.status})"  
 
+    def search_values(self):
+        return [self.student.username]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'start_time'], name='reservation_status_start_idx'),  # Past-due pending expiry
+            models.Index(fields=['student', 'updated_at'], name='reservation_student_upd_idx'),  # Per-student delta sync
+            models.Index(fields=['start_time', 'status'], name='reservation_start_status_idx'),  # Staff summary and windows
+            models.Index(fields=['status', 'created_at'], name='reservation_status_created_idx'),  # Pending work queue
+        ]
+
+
+# Model recording reservations removed from a calendar, so delta syncs can report them
+class ReservationTombstone(models.Model):
+    REASON_CHOICES = [
+        ('deleted', 'Deleted'),
+        ('hidden', 'Hidden for student'),
+    ]
+
+    RETENTION = timedelta(days=30)  # Older sync tokens must reload the full reservation list
+
+    reservation_id = models.BigIntegerField()  # Id of the removed reservation (the row itself may be gone)
+    student = models.ForeignKey(User, on_delete=models.CASCADE)
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Reservation {self.reservation_id} {self.reason}"
+
+    @classmethod
+    def record(cls, reservations, reason):
+        # Logs a tombstone per (reservation_id, student_id) pair in one INSERT
+        cls.objects.bulk_create([
+            cls(reservation_id=reservation_id, student_id=student_id, reason=reason)
+            for reservation_id, student_id in reservations
+        ])
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', 'created_at'], name='tombstone_student_created_idx'),
+        ]
+
 
 # Model representing an active user for tracking purposes
 class ActiveUser(models.Model):
@@ -79,5 +306,103 @@ class ActiveUser(models.Model):
     
     class Meta:
         verbose_name = "History Login"  
-        verbose_name_plural = "History Logins" 
-    
+        verbose_name_plural = "History Logins"
+
+
+# Model storing the first response for an `Idempotency-Key` so retried POSTs are replayed, not re-run
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=100)  # Name of the view the key was used on
+    key = models.CharField(max_length=255)  # Client supplied `Idempotency-Key` header
+    request_hash = models.CharField(max_length=64)  # SHA-256 of the request body, to detect key reuse
+    status_code = models.PositiveSmallIntegerField(null=True)  # Null while the first request is still running
+    response_body = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.endpoint} ({self.key})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+
+# Model holding the word tokens of orders and reservations, so admin search is an index range scan
+class SearchToken(models.Model):
+    KIND_CHOICES = [
+        ('order', 'Order'),
+        ('reservation', 'Reservation'),
+    ]
+    MAX_LENGTH = 64
+
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    token = models.CharField(max_length=MAX_LENGTH)
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.token}"
+
+    @classmethod
+    def index(cls, kind, objects):
+        # Replaces the tokens of the given saved objects (each providing `search_values()`)
+        objects = list(objects)
+        cls.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objects]).delete()
+        cls.objects.bulk_create([
+            cls(kind=kind, object_id=obj.pk, token=token)
+            for obj in objects
+            for token in search_tokens(*obj.search_values())
+        ])
+
+    @classmethod
+    def prefix_range(cls, term):
+        # Tokens starting with `term` as `gte`/`lt` bounds. A range is an index range scan on any backend,
+        # unlike `startswith` (LIKE), which SQLite and non-C-collation PostgreSQL run as a full scan
+        successor = term.rstrip(TOKEN_ALPHABET[-1])
+        if not successor:
+            return {'token__gte': term}  # Only "z"s: everything from `term` on
+        last = successor[-1]
+        return {'token__gte': term, 'token__lt': successor[:-1] + TOKEN_ALPHABET[TOKEN_ALPHABET.index(last) + 1]}
+
+    @classmethod
+    def filter_queryset(cls, queryset, kind, search_term):
+        # Keeps the rows having, for every word of the search term, a token starting with that word
+        for term in search_tokens(search_term):
+            matches = cls.objects.filter(kind=kind, **cls.prefix_range(term)).values('object_id')
+            queryset = queryset.filter(pk__in=matches)
+        return queryset
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'token', 'object_id'], name='searchtoken_lookup_idx'),
+            models.Index(fields=['kind', 'object_id'], name='searchtoken_object_idx'),
+        ]
+
+
+# Model queueing a student notification until it is sent as part of a digest (see api/notifications.py)
+class NotificationEvent(models.Model):
+    KIND_CHOICES = [
+        ('order_approved', 'Order approved'),
+        ('reservation_approved', 'Reservation approved'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict)  # Details rendered into the digest, e.g. the ordered hours
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} for {self.recipient_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'created_at'], name='notification_recipient_idx'),
+        ]
+
+
+# Emails set anywhere (admin user form, createsuperuser, registration, shell) reach the unique email index
+@receiver(post_save, sender=User)
+def sync_profile_email(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and "email" not in update_fields):
+        return
+    UserProfile.sync_email(instance)
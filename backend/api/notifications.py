@@ -0,0 +1,115 @@
+# backend/api/notifications.py
+
+'''
+Coalesced student notifications:
+1. Approval paths call `record_notifications` inside their transaction, so an event exists exactly when
+   the approval is committed. Nothing is sent at that point.
+2. `flush_notifications` (run by the `flush_notifications` management command) picks the students whose
+   oldest event is at least `NOTIFICATION_DIGEST_WINDOW` seconds old, renders all of their events into
+   one digest email and sends the digests `NOTIFICATION_BATCH_SIZE` at a time over a single mail
+   connection. Approving 50 orders of one student therefore sends one email, not 50.
+3. Digests are sent one by one over the batch's connection, and the events of each delivered digest are
+   deleted in the batch's transaction. If a send fails, the events of the digests already delivered are
+   still deleted and only the undelivered ones stay queued for the next flush. A digest can only be sent
+   twice if the database commit fails after the mail server accepted it.
+'''
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import NotificationEvent, UserProfile
+
+DIGEST_SUBJECTS = {
+    "order_approved": "Confirmation of Your Study Hour Order",
+    "reservation_approved": "Confirmation of Your Lesson Reservation",
+}
+DEFAULT_SUBJECT = "Updates to Your RedBlue Academy Account"
+
+
+def record_notifications(kind, events):
+    # Queues one event per (recipient_id, payload) pair with a single INSERT
+    NotificationEvent.objects.bulk_create([
+        NotificationEvent(recipient_id=recipient_id, kind=kind, payload=payload)
+        for recipient_id, payload in events
+    ])
+
+
+def describe_event(event):
+    if event.kind == "order_approved":
+        return f"- Your order for {event.payload['hours']} study hours has been approved."
+    start = timezone.localtime(parse_datetime(event.payload["start_time"]))
+    return f"- Your lesson on {start:%d.%m.%Y} at {start:%H:%M} has been approved."
+
+
+def render_digest(user, events, study_hours):
+    # One email summarizing all of the student's events, oldest first
+    kinds = {event.kind for event in events}
+    subject = DIGEST_SUBJECTS[kinds.pop()] if len(kinds) == 1 else DEFAULT_SUBJECT
+    message = (
+        f"Dear {user.first_name},\n\n"
+        f"We are pleased to inform you about the following updates to your account:\n"
+        + "\n".join(describe_event(event) for event in events)
+        + f"\n\nYou now have {study_hours} available study hours in your account.\n\n"
+        f"We wish you great success in your studies!\n\n"
+        f"Best regards,\n"
+        f"The RedBlue Academy Team"
+    )
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+
+
+def flush_notifications(window=None, batch_size=None):
+    # Sends the digests that are due and returns how many emails were sent
+    window = settings.NOTIFICATION_DIGEST_WINDOW if window is None else window
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=window)
+    due = list(
+        NotificationEvent.objects.values("recipient_id")
+        .annotate(oldest=Min("created_at"))
+        .filter(oldest__lte=cutoff)
+        .order_by("oldest")
+        .values_list("recipient_id", flat=True)
+    )
+    if not due:
+        return 0  # No connection is opened when nothing is due
+    sent = 0
+    with get_connection() as connection:  # One connection for every batch
+        for start in range(0, len(due), batch_size):
+            sent += send_batch(connection, due[start:start + batch_size])
+    return sent
+
+
+def send_batch(connection, recipient_ids):
+    with transaction.atomic():
+        # Locked so a concurrent flush skips these events instead of sending them twice
+        events = list(
+            NotificationEvent.objects.filter(recipient_id__in=recipient_ids)
+            .select_for_update(skip_locked=True).order_by("created_at", "id")
+        )
+        by_recipient = {}
+        for event in events:
+            by_recipient.setdefault(event.recipient_id, []).append(event)
+        users = list(User.objects.filter(id__in=by_recipient).exclude(email="").only("id", "first_name", "email"))
+        study_hours = dict(
+            UserProfile.objects.filter(user_id__in=by_recipient).values_list("user_id", "study_hours")
+        )
+        # Events of students without an email address are dropped with the delivered ones
+        done = set(by_recipient) - {user.id for user in users}
+        error = None
+        for user in users:
+            try:
+                connection.send_messages([render_digest(user, by_recipient[user.id], study_hours.get(user.id, 0))])
+            except Exception as e:
+                error = e  # The rest of the batch stays queued
+                break
+            done.add(user.id)
+        NotificationEvent.objects.filter(id__in=[event.id for event in events if event.recipient_id in done]).delete()
+    if error is not None:
+        raise error
+    return len(users)
@@ -0,0 +1,150 @@
+# backend/api/profiling.py
+
+'''
+Opt-in, sampled profiling for API views and admin actions:
+1. `ProfilingMiddleware`: Profiles a sample of requests with cProfile, from the view through response
+   rendering. Removed from the middleware chain entirely when `PROFILING_ENABLED` is off.
+2. `profile_action`: Decorator for admin actions, sampled the same way and labelled by action name.
+3. A request is profiled when it carries `PROFILING_HEADER` set to `PROFILING_TOKEN`, or when it matches
+   `PROFILING_TARGETS` (URL or action names, empty for all) and `PROFILING_USER_IDS` (empty for all)
+   and wins the `PROFILING_SAMPLE_RATE` draw.
+4. Profiles are written as `.prof` files (pstats call trees) to `PROFILING_DIR`, keeping at most
+   `PROFILING_MAX_FILES` of them. `manage.py profile_summary` aggregates them.
+5. At most one profiler runs per process: since Python 3.12 cProfile refuses to start while another one
+   is active in any thread. A sampled request that overlaps a profiled one (or an admin action inside a
+   profiled request) runs unprofiled, and profiling errors are logged, never raised to the request.
+'''
+
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+logger = logging.getLogger(__name__)
+
+_profiler_lock = threading.Lock()  # Held while a profiler runs in this process
+
+
+def get_profile_dir():
+    return Path(getattr(settings, "PROFILING_DIR", Path(settings.BASE_DIR) / "profiles"))
+
+
+def _user_id(request):
+    # Session users are known up front; for JWT requests only the token's claim is read (no DB lookup)
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = header and auth.get_raw_token(header)
+    if not raw_token:
+        return None
+    try:
+        return auth.get_validated_token(raw_token).get(settings.SIMPLE_JWT.get("USER_ID_CLAIM", "user_id"))
+    except InvalidToken:
+        return None
+
+
+def should_profile(request, target):
+    if _profiler_lock.locked():
+        return False
+
+    token = getattr(settings, "PROFILING_TOKEN", None)
+    header = getattr(settings, "PROFILING_HEADER", "X-Profile")
+    if token and request.headers.get(header) == token:
+        return True
+
+    targets = getattr(settings, "PROFILING_TARGETS", [])
+    if targets and target not in targets:
+        return False
+    if random.random() >= getattr(settings, "PROFILING_SAMPLE_RATE", 0.01):
+        return False
+    user_ids = getattr(settings, "PROFILING_USER_IDS", [])
+    if user_ids and str(_user_id(request)) not in {str(user_id) for user_id in user_ids}:
+        return False
+    return True
+
+
+def save_profile(profiler, label):
+    # Writes the profile and deletes the oldest ones beyond PROFILING_MAX_FILES
+    directory = get_profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    safe_label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000_000:09d}-{os.getpid()}-{safe_label}.prof"
+    profiler.dump_stats(directory / filename)
+
+    max_files = getattr(settings, "PROFILING_MAX_FILES", 200)
+    profiles = sorted(directory.glob("*.prof"), key=lambda path: path.stat().st_mtime)
+    for path in profiles[:-max_files]:
+        path.unlink(missing_ok=True)
+
+
+def start_profiler():
+    # An enabled profiler, or None when another one is running in this process
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Another profiling tool (e.g. a debugger) is active
+        _profiler_lock.release()
+        return None
+    return profiler
+
+
+def stop_profiler(profiler, label):
+    profiler.disable()
+    _profiler_lock.release()
+    try:
+        save_profile(profiler, label)
+    except OSError:
+        logger.exception("Could not save the profile of %s", label)  # Never fail the request over it
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILING_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            profiler = getattr(request, "_profiler", None)
+            if profiler is not None:
+                stop_profiler(profiler, f"{request.method}-{request._profile_label}")
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        label = request.resolver_match.url_name or view_func.__name__
+        if should_profile(request, label):
+            request._profiler = start_profiler()  # Stopped in __call__, after the response is rendered
+            request._profile_label = label
+        return None
+
+
+def profile_action(action):
+    # Profiles a sample of runs of an admin action, labelled "admin-<action name>"
+    @wraps(action)
+    def wrapper(modeladmin, request, queryset):
+        profiler = None
+        if getattr(settings, "PROFILING_ENABLED", False) and should_profile(request, action.__name__):
+            profiler = start_profiler()
+        if profiler is None:
+            return action(modeladmin, request, queryset)
+        try:
+            return action(modeladmin, request, queryset)
+        finally:
+            stop_profiler(profiler, f"admin-{action.__name__}")
+
+    return wrapper
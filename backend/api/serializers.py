@@ -3,7 +3,7 @@
 Serializers for API data conversion and validation:
 1. UserSerializer: Handles secure user creation with a write-only password and proper hashing.
 2. ReservationSerializer: Serializes reservation data, ensuring read-only access to the student and created_at fields.
-3. OrderSerializer: Manages order data serialization and enforces validation for unique email addresses, acceptance of terms, and GDPR policies.
+3. OrderSerializer: Manages order data serialization and enforces validation for unique (case-insensitive) email addresses, acceptance of terms, and GDPR policies.
 
 These serializers enable secure and reliable data conversion between Django models and JSON, ensuring validation and consistency for API interactions.
 '''
@@ -11,7 +11,7 @@ These serializers enable secure and reliable data conversion between Django mode
 
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Reservation, Order
+from .models import Reservation, Order, UserProfile, normalize_email
 
 # Serializer for the User model, handles user creation and password write-only configuration
 class UserSerializer(serializers.ModelSerializer):
@@ -41,9 +41,9 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['student', 'created_at']
     
-    # Check if the email is already in use
+    # Check if the email is already in use (case-insensitive, single probe of the unique email index)
     def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
+        if UserProfile.objects.filter(email_normalized=normalize_email(value)).exists():
             raise serializers.ValidationError("This email address is already in use. Please use a different one.")
         return value
     
@@ -0,0 +1,137 @@
+# backend/api/slowqueries.py
+
+'''
+Capture of slow database queries with their EXPLAIN plans:
+1. `SlowQueryMiddleware`: Installs a database execute wrapper for each request that times every query and
+   records those slower than `SLOW_QUERY_THRESHOLD_MS`, with the SQL fingerprint, the URL name or
+   admin action ("admin-<action>") that issued it, and the duration. Removed from the middleware chain
+   entirely when `SLOW_QUERY_ENABLED` is off.
+2. A `SLOW_QUERY_EXPLAIN_RATE` sample of the recorded SELECTs is explained through a separate database
+   connection, so the plan never runs inside (or waits for) the request's own transaction.
+3. Entries are kept in a ring buffer of `SLOW_QUERY_BUFFER_SIZE` slots in the shared cache, so the slow
+   queries of all workers are seen together. `top_offenders` aggregates the buffer by fingerprint.
+4. Staff see the buffer at /admin/slow-queries/ and as JSON at /api/slow-queries/.
+'''
+
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection, connections
+from django.utils import timezone
+
+from .querybudget import fingerprint
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_KEY = "slow_queries:sequence"
+CACHE_TIMEOUT = 7 * 24 * 60 * 60
+MAX_SQL_LENGTH = 4000
+
+def slot_key(index):
+    return f"slow_queries:slot:{index % settings.SLOW_QUERY_BUFFER_SIZE}"
+
+
+def explain(sql, params):
+    # EXPLAIN through a new connection to the same database (without the execute wrapper), closed right after
+    explain_connection = connections.create_connection("default")
+    try:
+        with explain_connection.cursor() as cursor:
+            cursor.execute(f"{explain_connection.ops.explain_query_prefix()} {sql}", params)
+            return [" | ".join(str(value) for value in row) for row in cursor.fetchall()]
+    except DatabaseError as e:
+        return [f"EXPLAIN failed: {e}"]
+    finally:
+        explain_connection.close()
+
+
+def record_slow_query(sql, params, duration, source):
+    # `params` is None for executemany() batches, which are not explained
+    plan = None
+    explainable = params is not None and sql.lstrip()[:6].upper() == "SELECT"
+    if explainable and random.random() < getattr(settings, "SLOW_QUERY_EXPLAIN_RATE", 0.1):
+        plan = explain(sql, params)
+    try:
+        index = cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        cache.add(SEQUENCE_KEY, 0, None)
+        index = cache.incr(SEQUENCE_KEY)
+    cache.set(slot_key(index), {
+        "seq": index,
+        "at": timezone.now().isoformat(),
+        "fingerprint": fingerprint(sql),
+        "sql": sql[:MAX_SQL_LENGTH],
+        "duration_ms": round(duration * 1000, 2),
+        "source": source,
+        "explain": plan,
+    }, CACHE_TIMEOUT)
+    logger.warning("Slow query (%.0f ms) from %s: %s", duration * 1000, source, sql[:200])
+
+
+def recent_slow_queries():
+    # Entries of the ring buffer, newest first
+    keys = [slot_key(index) for index in range(settings.SLOW_QUERY_BUFFER_SIZE)]
+    return sorted(cache.get_many(keys).values(), key=lambda entry: entry["seq"], reverse=True)
+
+
+def top_offenders(entries, limit=20):
+    # Fingerprints ordered by their total time in `entries`, with the latest sample and plan of each
+    groups = {}
+    for entry in entries:
+        group = groups.get(entry["fingerprint"])
+        if group is None:
+            group = groups[entry["fingerprint"]] = {
+                "fingerprint": entry["fingerprint"], "count": 0, "total_ms": 0, "max_ms": 0,
+                "sources": set(), "sample": entry["sql"], "explain": entry["explain"],
+            }
+        group["count"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+        group["sources"].add(entry["source"])
+        if group["explain"] is None:
+            group["explain"] = entry["explain"]
+    top = sorted(groups.values(), key=lambda group: group["total_ms"], reverse=True)[:limit]
+    for group in top:
+        group["total_ms"] = round(group["total_ms"], 2)
+        group["avg_ms"] = round(group["total_ms"] / group["count"], 2)
+        group["sources"] = sorted(group["sources"])
+    return top
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "SLOW_QUERY_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = settings.SLOW_QUERY_THRESHOLD_MS / 1000
+
+    def __call__(self, request):
+        request._slow_query_source = request.path  # Replaced by the URL or action name in process_view
+        with connection.execute_wrapper(self.wrapper(request)):
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = request.resolver_match.url_name or view_func.__name__
+        # Admin actions are posted to the changelist; attribute their queries to the action
+        if request.method == "POST" and name.endswith("_changelist") and request.POST.get("action"):
+            name = f"admin-{request.POST['action']}"
+        request._slow_query_source = name
+        return None
+
+    def wrapper(self, request):
+        def execute_wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = time.perf_counter() - started
+                if duration >= self.threshold:
+                    try:
+                        record_slow_query(sql, None if many else params, duration, request._slow_query_source)
+                    except Exception:
+                        logger.exception("Could not record a slow query")  # Never fail the request over it
+
+        return execute_wrapper
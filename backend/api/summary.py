@@ -0,0 +1,86 @@
+# backend/api/summary.py
+
+'''
+Aggregated reservation counts for the staff calendar overview:
+1. `get_reservation_summary`: Counts reservations per time bucket (hour or day) and status with a
+   single `GROUP BY` over the truncated `start_time`.
+2. Results are cached per (bucket, range). Every reservation write calls
+   `invalidate_reservation_summary`, which bumps a generation number that is part of each cache key,
+   so all cached summaries are dropped with one cache operation.
+'''
+
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+
+from .models import Reservation
+
+BUCKETS = {
+    "hour": (TruncHour, timedelta(hours=1)),
+    "day": (TruncDay, timedelta(days=1)),
+}
+GENERATION_KEY = "reservation_summary:generation"
+CACHE_TIMEOUT = 5 * 60
+
+
+def _generation():
+    # Current generation; (re)initialized from the clock so an evicted counter never reuses old keys
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_reservation_summary():
+    # Called after any write that changes reservations' status, time or existence
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+
+
+def align_range(start, end, bucket):
+    # Widens [start, end) to whole buckets so overlapping requests share cache entries
+    if bucket == "hour":
+        start = start.replace(minute=0, second=0, microsecond=0)
+        aligned_end = end.replace(minute=0, second=0, microsecond=0)
+    else:
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        aligned_end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    if aligned_end < end:
+        aligned_end += BUCKETS[bucket][1]
+    return start, aligned_end
+
+
+def get_reservation_summary(start, end, bucket):
+    # Returns [{"start": <bucket start>, "pending": n, "approved": n, ...}, ...] for non-empty buckets
+    start, end = align_range(start, end, bucket)
+    generation = _generation()
+    cache_key = f"reservation_summary:{generation}:{bucket}:{start.isoformat()}:{end.isoformat()}"
+
+    summary = cache.get(cache_key)
+    if summary is not None:
+        return start, end, summary
+
+    trunc = BUCKETS[bucket][0]
+    rows = (
+        Reservation.objects
+        .filter(start_time__gte=start, start_time__lt=end)
+        .annotate(slot=trunc("start_time"))
+        .values("slot", "status")
+        .annotate(count=Count("id"))
+        .order_by("slot")
+    )
+
+    buckets = {}
+    for row in rows:
+        entry = buckets.setdefault(row["slot"], {"start": row["slot"].isoformat(), **{s: 0 for s, _ in Reservation.STATUS_CHOICES}})
+        entry[row["status"]] = row["count"]
+    summary = list(buckets.values())
+
+    cache.set(cache_key, summary, CACHE_TIMEOUT)
+    return start, end, summary
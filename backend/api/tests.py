@@ -1,3 +1,1345 @@
-from django.test import TestCase
+import cProfile
+import io
+import json
+import os
+import tempfile
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from api import profiling, urls as api_urls
+from api.checks import check_shared_cache
+from api.idempotency import idempotent
+from api.models import (ActiveUser, IdempotencyKey, NotificationEvent, Order, Reservation, ReservationTombstone, SearchToken,
+                        UserProfile, search_tokens)
+from api.notifications import flush_notifications
+from api.querybudget import fingerprint
+from api.throttling import TokenBucketThrottle
+from api.slowqueries import recent_slow_queries, top_offenders
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+# Timing measurements only run on request, as they depend on the machine and its load
+RUN_BENCHMARKS = os.getenv("RUN_BENCHMARKS") == "1"
+
+
+class FastPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # The production hasher at a test-friendly cost; importable by the import's worker processes
+    iterations = 1000
+
+
+class ImportAcademyDataTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_ndjson(self, name, records):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w") as handle:
+            for record in records:
+                handle.write(json.dumps(record) + "\n")
+        return path
+
+    def import_data(self, path, kind, **options):
+        options.setdefault("workers", 0)
+        call_command("import_academy_data", path, kind=kind, stdout=io.StringIO(), **options)
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+    def test_imports_users_orders_and_reservations(self):
+        users = self.write_ndjson("users.ndjson", [
+            {"username": "anna", "password": "secret-1", "email": "Anna@Example.com", "study_hours": 4},
+            {"username": "ben", "password": "", "email": "anna@example.com"},
+            {"username": "anna", "password": "duplicate"},
+        ])
+        self.import_data(users, "users", workers=2)
+
+        anna = User.objects.get(username="anna")
+        self.assertTrue(anna.check_password("secret-1"))
+        self.assertFalse(User.objects.get(username="ben").has_usable_password())
+        self.assertEqual(anna.userprofile.study_hours, 4)
+        self.assertEqual(anna.userprofile.email_normalized, "anna@example.com")
+        self.assertIsNone(UserProfile.objects.get(user__username="ben").email_normalized)
+
+        orders = self.write_ndjson("orders.ndjson", [
+            {"username": "anna", "hours": 10, "status": "approved"},
+            {"username": "ben", "hours": 5},
+        ])
+        self.import_data(orders, "orders")
+        self.assertTrue(UserProfile.objects.get(user=anna).order_completed)
+        ben_profile = UserProfile.objects.get(user__username="ben")
+        self.assertEqual((ben_profile.pending_orders, ben_profile.pending_hours), (1, 5))
+
+        reservations = self.write_ndjson("reservations.ndjson", [
+            {"username": "anna", "start_time": "2030-01-01T10:00:00Z", "end_time": "2030-01-01T11:00:00Z"},
+        ])
+        self.import_data(reservations, "reservations")
+        self.assertEqual(Reservation.objects.get().student, anna)
+
+    def test_resumes_from_checkpoint(self):
+        User.objects.create_user("anna")
+        path = self.write_ndjson("orders.ndjson", [
+            {"username": "anna", "hours": 1},
+            {"username": "anna", "hours": 2},
+            {"username": "nobody", "hours": 3},
+            {"username": "anna", "hours": 4},
+        ])
+        with self.assertRaises(CommandError):
+            self.import_data(path, "orders", batch_size=2)
+        self.assertEqual(Order.objects.count(), 2)  # The first batch was committed before the failure
+
+        # Fix the bad record and re-run: only the records after the checkpoint are imported
+        lines = open(path).read().replace('"nobody"', '"anna"')
+        with open(path, "w") as handle:
+            handle.write(lines)
+        self.import_data(path, "orders", batch_size=2)
+        self.assertEqual(sorted(Order.objects.values_list("hours", flat=True)), [1, 2, 3, 4])
+        self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+    def test_user_import_with_hashing_workers(self):
+        # Real hasher (PBKDF2, at a low iteration count) in a process pool of two workers
+        path = self.write_ndjson("users.ndjson", (
+            {"username": f"student{i}", "password": f"pw{i}"} for i in range(20)
+        ))
+        with override_settings(PASSWORD_HASHERS=["api.tests.FastPBKDF2PasswordHasher"]):
+            self.import_data(path, "users", batch_size=8, workers=2)
+        self.assertEqual(User.objects.count(), 20)
+        user = User.objects.get(username="student7")
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$"))
+        self.assertTrue(user.check_password("pw7"))
+
+    @skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to measure")
+    def test_user_import_throughput(self):
+        # Reports the import rate with the configured password hasher and a process pool; nothing is asserted.
+        # The target is 100k users in 5 minutes (334 users/s); BENCHMARK_IMPORT_USERS sets the sample size.
+        count = int(os.getenv("BENCHMARK_IMPORT_USERS", "5000"))
+        workers = os.cpu_count()
+        path = self.write_ndjson("users.ndjson", (
+            {"username": f"student{i}", "password": f"pw{i}", "email": f"student{i}@example.com"}
+            for i in range(count)
+        ))
+        started = time.monotonic()
+        self.import_data(path, "users", batch_size=1000, workers=workers)
+        rate = count / (time.monotonic() - started)
+        self.assertEqual(User.objects.count(), count)
+        print(f"\nImported {count} users at {rate:.0f} users/s with {workers} workers and {settings.PASSWORD_HASHERS[0]} "
+              f"(100k users in {100_000 / rate / 60:.1f} min)")
+
+
+class QueryRecorder:
+    # Records every query on the default connection with the project frames of its call stack
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def __call__(self, execute, sql, params, many, context):
+        stack = [
+            frame for frame in traceback.extract_stack()[:-1]
+            if frame.filename.startswith(str(settings.BASE_DIR)) and not frame.filename.endswith(("tests.py", "manage.py"))
+        ]
+        self.queries.append((sql, stack))
+        return execute(sql, params, many, context)
+
+
+def api_requests(world):
+    # Requests per URL name in api/urls.py: (client, method, reverse() kwargs, data)
+    return {
+        "track_login": [("student", "post", {}, {})],
+        "get_study_hours": [("student", "get", {}, {})],
+        "create_reservation": [("student", "post", {}, {"start_time": world.future.isoformat(), "end_time": (world.future + timedelta(hours=1)).isoformat()})],
+        "list_reservations": [
+            ("student", "get", {}, {}),
+            ("student", "get", {}, {"since": world.since}),
+            ("staff", "get", {}, {}),
+            ("staff", "get", {}, {"since": world.since}),
+        ],
+        "reservation_summary": [("staff", "get", {}, {"start": world.now.isoformat(), "end": (world.future + timedelta(days=1)).isoformat(), "bucket": "hour"})],
+        "update_reservation_status": [
+            ("staff", "patch", {"pk": world.pending_reservation}, {"status": "approved"}),
+            ("staff", "patch", {"pk": world.pending_reservation}, {"status": "rejected"}),
+        ],
+        "hide_rejected_reservations": [("student", "post", {}, {})],
+        "delete_reservation": [("student", "delete", {"pk": world.pending_reservation}, {})],
+        "calendar_feed_token": [("student", "get", {}, {}), ("student", "post", {}, {})],
+        "calendar_feed": [("anonymous", "get", {"token": world.calendar_token}, {})],
+        "create_order": [("student", "post", {}, {
+            "first_name": "Anna", "last_name": "Novak", "email": "anna.novak@example.com", "phone": "123",
+            "address": "Main 1", "hours": 10, "terms_accepted": True, "gdpr_accepted": True,
+        })],
+        "get_user_profile": [("student", "get", {}, {})],
+        "session": [("anonymous", "post", {}, {"refresh": world.refresh_token})],
+        "create_hour_order": [("student", "post", {}, {"hours": 5})],
+        "pending_reservations_queue": [("staff", "get", {}, {"limit": 100})],
+        "pending_orders_queue": [("staff", "get", {}, {"limit": 100})],
+        "claim_reservations_queue": [("staff", "post", {}, {"limit": 100})],
+        "claim_orders_queue": [("staff", "post", {}, {"limit": 100})],
+        "release_reservations_queue": [("staff", "post", {}, {"ids": world.reservation_ids})],
+        "release_orders_queue": [("staff", "post", {}, {"ids": world.order_ids})],
+        "slow_queries": [("staff", "get", {}, {})],
+    }
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, API_THROTTLE_RATES={"default": None})
+class QueryBudgetTests(TestCase):
+    # Runs every endpoint and admin action against N and 10N seeded rows. The query count must not grow
+    # with the data and must stay within the budget declared next to the view (`@query_budget`) or on
+    # the ModelAdmin (`query_budgets`, for the changelist and Django's own actions).
+    N = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser("staff", "staff@example.com", "pw")
+        cls.student = User.objects.create_user("student", "student@example.com", "pw")
+        UserProfile.objects.filter(user=cls.student).update(study_hours=1000)  # Created with the email index
+
+    def setUp(self):
+        cache.clear()
+
+    def seed(self, size):
+        # `size` other students with a profile, a pending order and a reservation each (leased to staff),
+        # plus `size` pending and `size` rejected reservations, pending orders and tombstones of `student`
+        now = timezone.now()
+        future = now + timedelta(days=7)
+        lease = {"claimed_by": self.staff, "claimed_until": future}
+        students = User.objects.bulk_create([
+            User(username=f"student{i}", email=f"student{i}@example.com", first_name="Student") for i in range(size)
+        ])
+        UserProfile.objects.bulk_create([
+            UserProfile(user=user, study_hours=5, pending_orders=1, pending_hours=5, email_normalized=user.email) for user in students
+        ])
+        ActiveUser.objects.bulk_create([ActiveUser(user=user) for user in students])
+        Reservation.objects.bulk_create(
+            [Reservation(student=user, start_time=future, end_time=future, **lease) for user in students]
+            + [Reservation(student=self.student, start_time=future, end_time=future) for _ in range(size)]
+            + [Reservation(student=self.student, start_time=future, end_time=future, status="rejected") for _ in range(size)]
+        )
+        Order.objects.bulk_create(
+            [Order(student=user, email=user.email, hours=5, terms_accepted=True, gdpr_accepted=True, **lease) for user in students]
+            + [Order(student=self.student, hours=5, terms_accepted=True, gdpr_accepted=True) for _ in range(size)]
+        )
+        SearchToken.index("order", Order.objects.select_related("student"))
+        SearchToken.index("reservation", Reservation.objects.select_related("student"))
+        ReservationTombstone.objects.bulk_create([
+            ReservationTombstone(reservation_id=10_000 + i, student=self.student, reason="deleted") for i in range(size)
+        ])
+        UserProfile.objects.filter(user=self.student).update(calendar_token="feed-token")
+        return SimpleNamespace(
+            calendar_token="feed-token",
+            refresh_token=str(RefreshToken.for_user(self.student)),
+            now=now,
+            future=future,
+            since=str(int((now - timedelta(hours=1)).timestamp() * 1_000_000)),
+            pending_reservation=Reservation.objects.filter(student=self.student, status="pending").values_list("id", flat=True).first(),
+            reservation_ids=list(Reservation.objects.filter(claimed_by=self.staff).values_list("id", flat=True)),
+            order_ids=list(Order.objects.filter(claimed_by=self.staff).values_list("id", flat=True)),
+        )
+
+    def clients(self):
+        api_clients = {"anonymous": APIClient()}
+        for role, user in (("student", self.student), ("staff", self.staff)):
+            api_clients[role] = APIClient(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        return api_clients
+
+    def measure(self, size, run):
+        # Seeds `size` rows, records the queries of `run(world)` and rolls everything back
+        with transaction.atomic():
+            world = self.seed(size)
+            cache.clear()
+            ContentType.objects.clear_cache()  # Both sizes start with the same cold per-process caches
+            prepared = run(world)
+            with QueryRecorder() as recorder:
+                response = prepared()
+                content = b"".join(response.streaming_content) if response.streaming else response.content
+            self.assertLess(response.status_code, 400, content[:500])
+            transaction.set_rollback(True)
+        return recorder.queries
+
+    def statements(self, queries):
+        # Drops an INSERT repeating the previous one: bulk_create splits at the backend's parameter limit
+        # (e.g. 142 admin log rows on SQLite), which grows with the rows but is not an N+1
+        kept, previous = [], None
+        for sql, stack in queries:
+            key = fingerprint(sql)
+            if not (key == previous and key.startswith("INSERT")):
+                kept.append((sql, stack))
+            previous = key
+        return kept
+
+    def assert_within_budget(self, label, budget, run):
+        self.assertIsNotNone(budget, f"{label} has no declared query budget")
+        small = self.statements(self.measure(self.N, run))
+        large = self.statements(self.measure(10 * self.N, run))
+        if len(large) > len(small):
+            self.fail(f"{label}: {len(small)} queries with {self.N} rows, {len(large)} with {10 * self.N} rows\n"
+                      + self.describe(large, Counter(fingerprint(sql) for sql, _ in small)))
+        if len(large) > budget:
+            self.fail(f"{label}: {len(large)} queries, budget is {budget}\n" + self.describe(large, Counter()))
+
+    def describe(self, queries, baseline):
+        # Each query that ran more often than in `baseline`, with its count and the stack of its first run
+        counts = Counter(fingerprint(sql) for sql, _ in queries)
+        lines = []
+        for sql, stack in queries:
+            key = fingerprint(sql)
+            if key in counts and counts[key] > baseline[key]:
+                lines.append(f"\n[{counts.pop(key)}x] {sql[:1000]}\n" + "".join(traceback.format_list(stack)))
+        return "".join(lines)
+
+    def test_every_api_url_has_a_budget_and_a_request(self):
+        requests = api_requests(self.seed(0))
+        for pattern in api_urls.urlpatterns:
+            self.assertIn(pattern.name, requests, f"Add a request for {pattern.name} to api_requests")
+            self.assertTrue(hasattr(pattern.callback, "query_budget"), f"Declare @query_budget on {pattern.name}")
+
+    def test_api_query_budgets(self):
+        callbacks = {pattern.name: pattern.callback for pattern in api_urls.urlpatterns}
+        for name, variants in api_requests(self.seed(0)).items():
+            for index, (role, method, kwargs, _) in enumerate(variants):
+                def run(world, name=name, index=index):
+                    role, method, kwargs, data = api_requests(world)[name][index]
+                    client = self.clients()[role]
+                    path = reverse(name, kwargs=kwargs)
+                    fmt = {} if method == "get" else {"format": "json"}
+                    return lambda: getattr(client, method)(path, data, **fmt)
+
+                with self.subTest(url=name, variant=index):
+                    self.assert_within_budget(f"{name} #{index}", callbacks[name].query_budget, run)
+
+    def admin_cases(self):
+        # (label, budget, url, data) for each changelist and action of the api app's ModelAdmins
+        request = RequestFactory().get("/")
+        request.user = self.staff
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label != "api":
+                continue
+            budgets = getattr(model_admin, "query_budgets", {})
+            url = reverse(f"admin:api_{model._meta.model_name}_changelist")
+            yield f"{model.__name__} changelist", budgets.get("changelist"), url, None
+            for name, (func, _, _) in model_admin.get_actions(request).items():
+                budget = budgets.get(name, getattr(func, "query_budget", None))
+                data = {"action": name, "post": "yes"}  # "post" confirms delete_selected
+                yield f"{model.__name__}.{name}", budget, url, data
+
+    def test_admin_query_budgets(self):
+        for label, budget, url, data in self.admin_cases():
+            def run(world, url=url, data=data):
+                self.client.force_login(self.staff)
+                if data is None:
+                    return lambda: self.client.get(url)
+                selected = {**data, "_selected_action": [str(pk) for pk in self.selected_ids(url)]}
+                return lambda: self.client.post(url, selected)
+
+            with self.subTest(label):
+                self.assert_within_budget(label, budget, run)
+
+    def selected_ids(self, url):
+        for model in admin.site._registry:
+            if model._meta.app_label == "api" and reverse(f"admin:api_{model._meta.model_name}_changelist") == url:
+                return list(model.objects.values_list("pk", flat=True))
+
+
+@override_settings(API_THROTTLE_RATES={"default": None})
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user("student", "student@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        self.feed_url = self.client.get(reverse("calendar_feed_token")).data["url"]
+        self.start = timezone.now() + timedelta(days=1)
+
+    def reserve(self, status="pending"):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("create_reservation"), {
+                "start_time": self.start.isoformat(), "end_time": (self.start + timedelta(hours=1)).isoformat(),
+            }, format="json")
+        Reservation.objects.filter(pk=response.data["id"]).update(status=status)
+        return response.data["id"]
+
+    def test_feed_lists_pending_and_approved_lessons(self):
+        pending, approved, rejected = self.reserve(), self.reserve("approved"), self.reserve("rejected")
+        response = self.client.get(self.feed_url)
+        self.assertEqual(response["Content-Type"], "text/calendar; charset=utf-8")
+        body = b"".join(response.streaming_content).decode()
+        self.assertTrue(body.startswith("BEGIN:VCALENDAR\r\n") and body.endswith("END:VCALENDAR\r\n"))
+        self.assertIn(f"UID:reservation-{pending}@redblueacademy.com\r\n", body)
+        self.assertIn("STATUS:CONFIRMED", body)
+        self.assertIn(f"reservation-{approved}@", body)
+        self.assertNotIn(f"reservation-{rejected}@", body)
+
+    def test_conditional_polls_and_invalidation(self):
+        self.reserve()
+        first = self.client.get(self.feed_url)
+        first_body = b"".join(first.streaming_content)
+        etag = first["ETag"]
+
+        # Unchanged reservations: a 304 without touching the reservations, then the cached body
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.feed_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.feed_url)
+        self.assertEqual(cached.content, first_body)
+        self.assertEqual(self.client.get(self.feed_url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]).status_code, 304)
+
+        # Another student's change keeps this feed's version; the student's own change invalidates it
+        other = User.objects.create_user("other")
+        Reservation.objects.create(student=other, start_time=self.start, end_time=self.start)
+        self.assertEqual(self.client.get(self.feed_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        time.sleep(0.001)
+        self.reserve()
+        response = self.client.get(self.feed_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(b"".join(response.streaming_content).count(b"BEGIN:VEVENT"), 2)
+
+    def test_version_follows_the_database(self):
+        # Writes from commands or other workers invalidate no cache; the version is read from the rows
+        reservation = self.reserve()
+        etag = self.client.get(self.feed_url)["ETag"]
+        time.sleep(0.001)
+        Reservation.objects.filter(pk=reservation).update(status="rejected", updated_at=timezone.now())
+        response = self.client.get(self.feed_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b"BEGIN:VEVENT", b"".join(response.streaming_content))
+
+        kept = self.reserve()
+        etag = self.client.get(self.feed_url)["ETag"]
+        time.sleep(0.001)
+        ReservationTombstone.record([(kept, self.student.pk)], "deleted")
+        Reservation.objects.filter(pk=kept).delete()  # The newest change is now the tombstone
+        self.assertEqual(self.client.get(self.feed_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_reassigning_in_the_admin_changes_the_previous_students_feed(self):
+        reservation = Reservation.objects.get(pk=self.reserve())
+        etag = self.client.get(self.feed_url)["ETag"]
+        other = User.objects.create_user("other")
+        staff = APIClient()
+        staff.force_login(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+        time.sleep(0.001)
+        start, end = timezone.localtime(reservation.start_time), timezone.localtime(reservation.end_time)
+        staff.post(reverse("admin:api_reservation_change", args=[reservation.pk]), {
+            "student": other.pk, "status": "pending",
+            "start_time_0": f"{start:%Y-%m-%d}", "start_time_1": f"{start:%H:%M:%S}",
+            "end_time_0": f"{end:%Y-%m-%d}", "end_time_1": f"{end:%H:%M:%S}",
+        })
+        self.assertEqual(Reservation.objects.get(pk=reservation.pk).student, other)
+        response = self.client.get(self.feed_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b"BEGIN:VEVENT", b"".join(response.streaming_content))
+
+    def test_rotating_the_token_revokes_the_old_url(self):
+        new_url = self.client.post(reverse("calendar_feed_token")).data["url"]
+        self.assertNotEqual(new_url, self.feed_url)
+        self.assertEqual(self.client.get(self.feed_url).status_code, 404)
+        self.assertEqual(self.client.get(new_url).status_code, 200)
+
+
+@override_settings(
+    SLOW_QUERY_ENABLED=True, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_EXPLAIN_RATE=1, SLOW_QUERY_BUFFER_SIZE=5,
+    API_THROTTLE_RATES={"default": None},
+)
+class SlowQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_superuser("staff", "staff@example.com", "pw")
+        self.client.force_login(self.staff)
+
+    def test_records_slow_queries_with_source_and_plans(self):
+        student = User.objects.create_user("student")
+        now = timezone.now()
+        reservation = Reservation.objects.create(student=student, start_time=now, end_time=now)
+        self.client.post(reverse("admin:api_reservation_changelist"), {
+            "action": "reject_reservations", "_selected_action": [reservation.pk],
+        })
+
+        entries = recent_slow_queries()
+        self.assertEqual(len(entries), 5)  # Every query is "slow" at a 0 ms threshold; the buffer keeps 5
+        self.assertEqual([entry["seq"] for entry in entries], sorted((entry["seq"] for entry in entries), reverse=True))
+        self.assertTrue(all(entry["source"] == "admin-reject_reservations" for entry in entries))
+        selects = [entry for entry in entries if entry["sql"].startswith("SELECT")]
+        self.assertTrue(selects and all(entry["explain"] for entry in selects))
+        self.assertFalse(any("EXPLAIN failed" in line for entry in selects for line in entry["explain"]))
+
+    def test_top_offenders_by_total_time(self):
+        entries = [
+            {"fingerprint": "A", "sql": "a", "duration_ms": 10, "source": "x", "explain": None},
+            {"fingerprint": "B", "sql": "b", "duration_ms": 15, "source": "y", "explain": ["plan"]},
+            {"fingerprint": "A", "sql": "a", "duration_ms": 10, "source": "z", "explain": None},
+        ]
+        top = top_offenders(entries)
+        self.assertEqual([(group["fingerprint"], group["total_ms"], group["count"]) for group in top], [("A", 20, 2), ("B", 15, 1)])
+        self.assertEqual(top[0]["sources"], ["x", "z"])
+
+    def test_staff_pages(self):
+        response = self.client.get(reverse("slow_queries_admin"))
+        self.assertContains(response, "Top offenders by total time")
+        api_client = APIClient()
+        api_client.force_authenticate(self.staff)
+        data = api_client.get(reverse("slow_queries")).data
+        self.assertTrue(data["enabled"])
+        self.assertTrue(data["queries"] and data["top"])
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("slow_queries_admin")).status_code, 302)  # Redirected to the login
+
+
+@override_settings(API_THROTTLE_RATES={"default": None})
+class SessionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("anna", "anna@example.com", "pw")
+        UserProfile.objects.filter(user=self.user).update(study_hours=7, pending_orders=1, pending_hours=10)
+        self.client = APIClient()
+
+    def start_session(self, refresh):
+        return self.client.post(reverse("session"), {"refresh": refresh}, format="json")
+
+    def test_refreshes_tokens_tracks_activity_and_returns_profile(self):
+        response = self.start_session(str(RefreshToken.for_user(self.user)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["username"], "anna")
+        self.assertEqual(response.data["study_hours"], 7)
+        self.assertEqual((response.data["order_pending"], response.data["order_completed"]), (True, False))
+        self.assertTrue(ActiveUser.objects.filter(user=self.user).exists())
+
+        # The new access token authenticates; the rotated refresh token starts the next session
+        self.assertEqual(AccessToken(response.data["access"])["user_id"], str(self.user.pk))
+        with self.assertNumQueries(2):  # Activity UPDATE and profile read; the user check is cached
+            self.assertEqual(self.start_session(response.data["refresh"]).status_code, 200)
+
+    def test_rejects_invalid_tokens_and_inactive_users(self):
+        self.assertEqual(self.start_session("").status_code, 400)
+        self.assertEqual(self.start_session("not-a-token").status_code, 401)
+        access = str(AccessToken.for_user(self.user))
+        self.assertEqual(self.start_session(access).status_code, 401)  # Wrong token type
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.start_session(str(RefreshToken.for_user(self.user))).status_code, 401)
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    # locmem backend counting the connections opened, as each would be one SMTP session
+    connections = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CountingEmailBackend.connections += 1
+
+
+class FailingAfterOneEmailBackend(locmem.EmailBackend):
+    # Accepts the first message of the test outbox and drops the connection on the next ones
+    def send_messages(self, messages):
+        if mail.outbox:
+            raise ConnectionResetError("Connection lost")
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND="api.tests.CountingEmailBackend", NOTIFICATION_DIGEST_WINDOW=300)
+class NotificationDigestTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+        self.anna = User.objects.create_user("anna", "anna@example.com", first_name="Anna")
+        self.ben = User.objects.create_user("ben", "ben@example.com", first_name="Ben")
+        UserProfile.objects.filter(user=self.anna).update(study_hours=2)
+        CountingEmailBackend.connections = 0
+
+    def approve(self, model, action, objects):
+        self.client.post(reverse(f"admin:api_{model}_changelist"), {
+            "action": action, "_selected_action": [obj.pk for obj in objects],
+        })
+
+    def test_bulk_approvals_send_one_digest_per_student(self):
+        orders = [
+            Order.objects.create(student=student, first_name="x", last_name="y", email=student.email, hours=hours,
+                                 terms_accepted=True, gdpr_accepted=True)
+            for student, hours in [(self.anna, 10), (self.anna, 20), (self.ben, 5), (self.anna, 30)]
+        ]
+        start = timezone.now() + timedelta(days=1)
+        lesson = Reservation.objects.create(student=self.anna, start_time=start, end_time=start + timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.approve("order", "approve_orders", orders)
+            self.approve("reservation", "approve_reservations", [lesson])
+        self.assertEqual(len(mail.outbox), 0)  # Queued, not sent
+        self.assertEqual(NotificationEvent.objects.count(), 5)
+
+        self.assertEqual(flush_notifications(), 0)  # Still within the coalescing window
+        with self.assertNumQueries(7):  # Due students, then per batch: events, users, profiles, delete + savepoint
+            self.assertEqual(flush_notifications(window=0), 2)
+        self.assertEqual(CountingEmailBackend.connections, 1)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+        digests = {message.to[0]: message for message in mail.outbox}
+        anna = digests["anna@example.com"]
+        self.assertEqual(anna.subject, "Updates to Your RedBlue Academy Account")
+        for line in ["10 study hours", "20 study hours", "30 study hours", f"{start:%d.%m.%Y}", "You now have 61 "]:
+            self.assertIn(line, anna.body)
+        self.assertEqual(digests["ben@example.com"].subject, "Confirmation of Your Study Hour Order")
+
+    @override_settings(API_THROTTLE_RATES={"default": None})
+    def test_api_approval_queues_a_notification(self):
+        start = timezone.now() + timedelta(days=1)
+        lessons = [Reservation.objects.create(student=student, start_time=start, end_time=start)
+                   for student in (self.anna, self.anna, self.ben)]
+        staff = APIClient()
+        staff.force_authenticate(User.objects.get(username="staff"))
+
+        def update(lesson, new_status):
+            return staff.patch(reverse("update_reservation_status", args=[lesson.pk]), {"status": new_status}, format="json")
+
+        self.assertEqual(update(lessons[0], "approved").status_code, 200)
+        self.assertEqual(update(lessons[1], "rejected").status_code, 200)
+        self.assertEqual(update(lessons[2], "approved").status_code, 400)  # Ben has no study hours
+        event = NotificationEvent.objects.get()
+        self.assertEqual((event.recipient, event.kind), (self.anna, "reservation_approved"))
+        self.assertEqual(UserProfile.objects.get(user=self.anna).study_hours, 1)
+
+    def test_failed_send_keeps_events_queued(self):
+        NotificationEvent.objects.create(recipient=self.anna, kind="order_approved", payload={"hours": 10})
+        with override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend", EMAIL_HOST="invalid.invalid"):
+            with self.assertRaises(OSError):
+                flush_notifications(window=0)
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+        self.assertEqual(flush_notifications(window=0, batch_size=1), 1)
+
+    def test_partial_failure_keeps_only_undelivered_digests_queued(self):
+        for student in [self.anna, self.ben]:
+            NotificationEvent.objects.create(recipient=student, kind="order_approved", payload={"hours": 10})
+        with override_settings(EMAIL_BACKEND="api.tests.FailingAfterOneEmailBackend"):
+            with self.assertRaises(OSError):
+                flush_notifications(window=0)
+        self.assertEqual(len(mail.outbox), 1)
+        delivered = mail.outbox[0].to[0]
+        queued = NotificationEvent.objects.get()
+        self.assertNotEqual(queued.recipient.email, delivered)
+
+        self.assertEqual(flush_notifications(window=0), 1)  # The retry sends only the missing digest
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ["anna@example.com", "ben@example.com"])
+
+
+@override_settings(API_THROTTLE_RATES={"default": None}, SYNC_TOKEN_SAFETY_MARGIN=30)
+class ReservationSyncTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user("anna")
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        now = timezone.now()
+        self.pending, self.rejected = [
+            Reservation.objects.create(student=self.student, start_time=now, end_time=now, status=status)
+            for status in ["pending", "rejected"]
+        ]
+
+    def sync(self, since):
+        return self.client.get(reverse("list_reservations"), {"since": since})
+
+    def age(self, seconds):
+        # Moves every change further into the past than the sync token's safety margin
+        past = timezone.now() - timedelta(seconds=seconds)
+        Reservation.objects.update(updated_at=past)
+        ReservationTombstone.objects.update(created_at=past)
+
+    def test_full_list_returns_a_back_dated_token(self):
+        response = self.client.get(reverse("list_reservations"))
+        self.assertEqual(len(response.data), 2)
+        token_age = time.time() - int(response["X-Sync-Token"]) / 1_000_000
+        self.assertAlmostEqual(token_age, 30, delta=5)
+
+    def test_delta_reports_changed_rows_and_tombstones(self):
+        self.age(60)
+        token = self.client.get(reverse("list_reservations"))["X-Sync-Token"]
+        self.age(60)
+        data = self.sync(token).data
+        self.assertEqual((data["changed"], data["removed"]), ([], []))  # Nothing changed
+
+        self.rejected.start_time += timedelta(hours=1)
+        self.rejected.save()
+        self.client.delete(reverse("delete_reservation", args=[self.pending.pk]))
+        data = self.sync(token).data
+        self.assertEqual([row["id"] for row in data["changed"]], [self.rejected.pk])
+        self.assertEqual(data["removed"], [self.pending.pk])
+
+        self.client.post(reverse("hide_rejected_reservations"))
+        data = self.sync(token).data
+        self.assertEqual(data["changed"], [])  # Hidden rows are reported as removed, not changed
+        self.assertEqual(sorted(data["removed"]), sorted([self.pending.pk, self.rejected.pk]))
+
+    def test_write_committed_after_the_listing_is_in_the_next_delta(self):
+        self.age(60)
+        token = self.client.get(reverse("list_reservations"))["X-Sync-Token"]
+        # `updated_at` was set 5 s before the token was issued, but the row only became visible afterwards
+        Reservation.objects.filter(pk=self.pending.pk).update(
+            status="approved", updated_at=timezone.now() - timedelta(seconds=5)
+        )
+        self.assertEqual([row["id"] for row in self.sync(token).data["changed"]], [self.pending.pk])
+
+    def test_expired_and_invalid_tokens(self):
+        expired = timezone.now() - ReservationTombstone.RETENTION - timedelta(days=1)
+        self.assertEqual(self.sync(int(expired.timestamp() * 1_000_000)).status_code, 410)
+        for token in ["abc", "", "999999999999999999999999999999", "-999999999999999999999"]:
+            self.assertEqual(self.sync(token).status_code, 400, token)
+
+
+
+@api_view(["POST"])
+@idempotent
+def failing_view(request):
+    return Response({"error": "Unavailable"}, status=503)
+
+
+@api_view(["POST"])
+@idempotent
+def raising_view(request):
+    raise RuntimeError("boom")
+
+
+@api_view(["POST"])
+@idempotent
+def outlived_view(request):
+    # The first run outlives its lease, and a retry takes the claim over while it is still running
+    outlived_view.runs += 1
+    run = outlived_view.runs
+    if run == 1:
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        retry = APIRequestFactory().post("/", {}, format="json", HTTP_IDEMPOTENCY_KEY=request.headers["Idempotency-Key"])
+        force_authenticate(retry, request.user)
+        outlived_view(retry)
+    return Response({"run": run}, status=201)
+
+
+@override_settings(API_THROTTLE_RATES={"default": None})
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user("anna")
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        self.lesson = {"start_time": "2030-01-07T10:00:00Z", "end_time": "2030-01-07T11:00:00Z"}
+
+    def reserve(self, key, data=None):
+        return self.client.post(reverse("create_reservation"), data or self.lesson, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.reserve("k1")
+        retry = self.reserve("k1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Reservation.objects.count(), 1)
+
+        cache.clear()  # Falls back to the stored row
+        self.assertEqual(self.reserve("k1").json(), first.json())
+        self.assertEqual(Reservation.objects.count(), 1)
+
+        self.reserve("k2")  # A new key runs the view again
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_key_reused_with_a_different_body(self):
+        self.reserve("k1")
+        other = dict(self.lesson, end_time="2030-01-07T12:00:00Z")
+        self.assertEqual(self.reserve("k1", other).status_code, 422)
+        cache.clear()
+        self.assertEqual(self.reserve("k1", other).status_code, 422)
+
+    def test_concurrent_duplicate_gets_409(self):
+        # A claimed key without a status code belongs to a request that is still running
+        self.reserve("k1")
+        cache.clear()
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+        self.assertEqual(self.reserve("k1").status_code, 409)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_PROCESSING_TIMEOUT=30)
+    def test_abandoned_claim_is_taken_over(self):
+        # The worker running the first request was killed before storing the response
+        self.reserve("k1")
+        cache.clear()
+        Reservation.objects.all().delete()
+        IdempotencyKey.objects.update(status_code=None, response_body=None, created_at=timezone.now() - timedelta(seconds=20))
+        self.assertEqual(self.reserve("k1").status_code, 409)  # Still within the lease
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=40))
+        first = self.reserve("k1")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(self.reserve("k1").json(), first.json())
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_request_that_lost_its_claim_does_not_overwrite_it(self):
+        outlived_view.runs = 0
+        request = APIRequestFactory().post("/", {}, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        force_authenticate(request, self.student)
+        self.assertEqual(outlived_view(request).data, {"run": 1})
+        claim = IdempotencyKey.objects.get()
+        self.assertEqual((claim.status_code, claim.response_body), (201, {"run": 2}))
+
+    def test_server_errors_are_not_stored(self):
+        factory = APIRequestFactory()
+        for view, expected in [(failing_view, 503), (raising_view, RuntimeError)]:
+            request = factory.post("/", {}, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+            force_authenticate(request, self.student)
+            if expected is RuntimeError:
+                with self.assertRaises(RuntimeError):
+                    view(request)
+            else:
+                self.assertEqual(view(request).status_code, expected)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expired_keys_are_evicted_and_purged(self):
+        self.reserve("k1")
+        cache.clear()
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(self.reserve("k1").status_code, 201)  # Expired key: the request runs again
+        self.assertEqual(Reservation.objects.count(), 2)
+
+        IdempotencyKey.objects.create(user=self.student, endpoint="create_order", key="old", request_hash="x")
+        IdempotencyKey.objects.filter(key="old").update(created_at=timezone.now() - timedelta(seconds=120))
+        out = io.StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1 expired", out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["k1"])
+
+
+
+@override_settings(API_THROTTLE_RATES={"default": "5/min", "list_reservations": "2/min", "session": "1/min"})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000.0
+        patcher = mock.patch("api.throttling.time")
+        self.clock = patcher.start()
+        self.clock.time.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+        self.student = User.objects.create_user("anna")
+        self.anna, self.ben = APIClient(), APIClient()
+        self.anna.force_authenticate(self.student)
+        self.ben.force_authenticate(User.objects.create_user("ben"))
+
+    def statuses(self, client, name, count, method="get", **extra):
+        return [getattr(client, method)(reverse(name), **extra).status_code for _ in range(count)]
+
+    def test_bucket_allows_the_burst_then_refills(self):
+        with self.assertLogs("api.throttling", "WARNING"):  # Denials are logged
+            self.assertEqual(self.statuses(self.anna, "list_reservations", 3), [200, 200, 429])
+            response = self.anna.get(reverse("list_reservations"))
+            self.assertEqual(response["Retry-After"], "30")  # One token refills every 30 s
+            self.now += 30
+            self.assertEqual(self.statuses(self.anna, "list_reservations", 2), [200, 429])
+            self.now += 3600  # An idle bucket refills to the burst, not beyond it
+            self.assertEqual(self.statuses(self.anna, "list_reservations", 3), [200, 200, 429])
+
+    def test_rates_per_url_name_and_buckets_per_user_or_ip(self):
+        with self.assertLogs("api.throttling", "WARNING"):
+            self.assertEqual(self.statuses(self.anna, "list_reservations", 3), [200, 200, 429])
+            self.assertEqual(self.statuses(self.anna, "get_user_profile", 6), [200] * 5 + [429])  # Default rate
+            self.assertEqual(self.statuses(self.ben, "list_reservations", 1), [200])  # Own bucket
+
+            anonymous = APIClient()
+            self.assertEqual(self.statuses(anonymous, "session", 2, "post", REMOTE_ADDR="10.0.0.1"), [400, 429])
+            self.assertEqual(self.statuses(anonymous, "session", 1, "post", REMOTE_ADDR="10.0.0.2"), [400])
+
+    def test_session_buckets_per_token_user(self):
+        # Students behind one address each get their own bucket; invalid tokens share the address's bucket
+        client = APIClient(REMOTE_ADDR="10.0.0.1")
+        refresh = {name: {"refresh": str(RefreshToken.for_user(User.objects.get(username=name)))} for name in ["anna", "ben"]}
+        session = lambda data: client.post(reverse("session"), data, format="json").status_code
+        with self.assertLogs("api.throttling", "WARNING"):
+            self.assertEqual([session(refresh["anna"]), session(refresh["anna"])], [200, 429])
+            self.assertEqual(session(refresh["ben"]), 200)
+            self.assertEqual([session({"refresh": "bad"}), session({"refresh": "bad"})], [401, 429])
+
+    @skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to measure")
+    def test_check_overhead(self):
+        # Reports the cost of one throttle check on the configured cache; nothing is asserted
+        self.clock.time.side_effect = time.time
+        request = SimpleNamespace(resolver_match=SimpleNamespace(url_name="default"), user=self.student)
+        with override_settings(API_THROTTLE_RATES={"default": "1000000/s"}):
+            throttle, view = TokenBucketThrottle(), SimpleNamespace()
+            count = 20000
+            started = time.perf_counter()
+            for _ in range(count):
+                throttle.allow_request(request, view)
+            elapsed = time.perf_counter() - started
+        print(f"\nThrottle check: {elapsed / count * 1e6:.1f} us on {settings.CACHES['default']['BACKEND']}")
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.zoe = User.objects.create_user("zoe.m")
+        self.max = User.objects.create_user("maxi")
+        self.mueller = self.order(self.zoe, "Zoë", "Müller", "zoe@example.com")
+        self.miller = self.order(self.max, "Zoe", "Miller", "max@example.com")
+
+    def order(self, student, first_name, last_name, email):
+        return Order.objects.create(student=student, first_name=first_name, last_name=last_name, email=email,
+                                    hours=10, terms_accepted=True, gdpr_accepted=True)
+
+    def search(self, term):
+        queryset, _ = admin.site._registry[Order].get_search_results(None, Order.objects.all(), term)
+        return set(queryset)
+
+    def test_prefix_and_all_words_match_accent_insensitively(self):
+        self.assertEqual(self.search("mül"), {self.mueller})  # Prefix, accents folded on both sides
+        self.assertEqual(self.search("ZOE"), {self.mueller, self.miller})
+        self.assertEqual(self.search("zoe mil"), {self.miller})  # Every word must match
+        self.assertEqual(self.search("zoe nobody"), set())
+        self.assertEqual(self.search("example"), {self.mueller, self.miller})  # Email words
+        self.assertEqual(self.search("maxi"), {self.miller})  # Username
+        self.assertEqual(self.search(""), {self.mueller, self.miller})
+        self.assertEqual(self.search("--"), {self.mueller, self.miller})  # No words: no filter
+
+    def test_prefix_range_bounds(self):
+        self.assertEqual(SearchToken.prefix_range("smi"), {"token__gte": "smi", "token__lt": "smj"})
+        self.assertEqual(SearchToken.prefix_range("s9"), {"token__gte": "s9", "token__lt": "sa"})  # Digits sort first
+        self.assertEqual(SearchToken.prefix_range("az"), {"token__gte": "az", "token__lt": "b"})
+        self.assertEqual(SearchToken.prefix_range("zz"), {"token__gte": "zz"})
+        for token in ["z", "zz", "zzz1"]:
+            SearchToken.objects.create(kind="order", object_id=self.miller.pk, token=token)
+        self.assertEqual(self.search("zz"), {self.miller})
+
+    def test_only_changed_search_fields_reindex(self):
+        self.miller.status = "approved"
+        with self.assertNumQueries(1):  # Only the UPDATE; the tokens are untouched
+            self.miller.save()
+        order = Order.objects.get(pk=self.miller.pk)
+        order.last_name = "Smith"
+        order.save()
+        self.assertEqual(self.search("smi"), {self.miller})
+        self.assertEqual(self.search("miller"), set())
+
+        reservation = Reservation.objects.create(student=self.zoe, start_time=timezone.now(), end_time=timezone.now())
+        reservation = Reservation.objects.get(pk=reservation.pk)
+        reservation.student = self.max  # Reassigned in the admin
+        reservation.save()
+        matches = SearchToken.filter_queryset(Reservation.objects.all(), "reservation", "maxi")
+        self.assertEqual(list(matches), [reservation])
+
+    def test_import_indexes_only_the_batch_rows(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, "orders.ndjson")
+        with open(path, "w") as handle:
+            for hours in [1, 2]:
+                handle.write(json.dumps({"username": "zoe.m", "first_name": "Imported", "hours": hours}) + "\n")
+        with mock.patch.object(SearchToken, "index", wraps=SearchToken.index) as index:
+            call_command("import_academy_data", path, kind="orders", workers=0, stdout=io.StringIO())
+        (kind, rows), = [call.args for call in index.call_args_list]
+        self.assertEqual((kind, rows.count()), ("order", 2))  # Not the student's earlier order
+        self.assertEqual(len(self.search("imported")), 2)
+
+    @skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to measure")
+    def test_search_latency(self):
+        # Reports the admin search time over BENCHMARK_SEARCH_ORDERS orders (default 200k); nothing is asserted
+        count = int(os.getenv("BENCHMARK_SEARCH_ORDERS", "200000"))
+        names = ["smith", "jones", "novak", "horvath", "kovac", "varga", "toth", "nagy", "balog", "molnar"]
+        for start in range(0, count, 10000):
+            orders = Order.objects.bulk_create([
+                Order(student=self.zoe, first_name=f"first{i % 5000}", last_name=names[i % 10], email=f"s{i}@example.com",
+                      hours=1, terms_accepted=True, gdpr_accepted=True)
+                for i in range(start, min(start + 10000, count))
+            ])
+            SearchToken.objects.bulk_create([
+                SearchToken(kind="order", object_id=order.pk, token=token)
+                for order in orders for token in search_tokens(order.first_name, order.last_name, order.email)
+            ])
+        for term in ["first123 smith", "novak", "s4242"]:
+            queryset = SearchToken.filter_queryset(Order.objects.order_by("-id"), "order", term)
+            started = time.perf_counter()
+            found = len(list(queryset[:100]))  # The changelist's first page
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"\nSearch {term!r} over {count} orders: {found} rows in {elapsed:.1f} ms on {connection.vendor}")
+
+
+@override_settings(API_THROTTLE_RATES={"default": None})
+class ProfileCounterTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_superuser("staff", "staff@example.com", "pw")
+        self.student = User.objects.create_user("anna")
+        self.client.force_login(self.staff)
+        self.api = APIClient()
+        self.api.force_authenticate(self.student)
+
+    def state(self):
+        profile = UserProfile.objects.get(user=self.student)
+        return profile.order_completed, profile.pending_orders, profile.pending_hours, profile.study_hours
+
+    def order(self, hours):
+        self.api.post(reverse("create_hour_order"), {"hours": hours}, format="json")
+        return Order.objects.latest("id")
+
+    def admin_action(self, action, orders):
+        self.client.post(reverse("admin:api_order_changelist"), {"action": action, "_selected_action": [o.pk for o in orders]})
+
+    def test_counters_follow_the_order_lifecycle(self):
+        response = self.api.post(reverse("create_order"), {
+            "first_name": "Anna", "last_name": "K", "email": "Anna@Example.com", "phone": "1", "address": "x",
+            "hours": 10, "terms_accepted": True, "gdpr_accepted": True,
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.state(), (False, 1, 10, 0))
+        self.assertEqual(UserProfile.objects.get(user=self.student).email_normalized, "anna@example.com")
+
+        second, third, fourth = self.order(20), self.order(30), self.order(40)
+        self.assertEqual(self.state(), (False, 4, 100, 0))
+
+        self.admin_action("approve_orders", [Order.objects.earliest("id"), second])
+        self.assertEqual(self.state(), (True, 2, 70, 30))
+        self.admin_action("reject_orders", [third])
+        self.assertEqual(self.state(), (True, 1, 40, 30))
+
+        # An admin edit of the status and a deletion rebuild the counters from the orders
+        response = self.client.post(reverse("admin:api_order_change", args=[fourth.pk]), {
+            **{field: getattr(fourth, field) for field in ["first_name", "last_name", "email", "hours"]},
+            "phone": "1", "address": "x", "student": self.student.pk, "terms_accepted": "on", "gdpr_accepted": "on", "status": "rejected",
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.state(), (True, 0, 0, 30))
+        self.order(5)
+        self.assertEqual(self.state(), (True, 1, 5, 30))
+        self.client.post(reverse("admin:api_order_delete", args=[Order.objects.latest("id").pk]), {"post": "yes"})
+        self.assertEqual(self.state(), (True, 0, 0, 30))
+
+    def test_expiry_releases_pending_orders(self):
+        self.order(10)
+        self.order(20)
+        Order.objects.update(created_at=timezone.now() - timedelta(days=40))
+        call_command("expire_reservations", orders_older_than=30, stdout=io.StringIO())
+        self.assertEqual(self.state(), (False, 0, 0, 0))
+
+    def test_repair_restores_drifted_counters(self):
+        self.order(10)
+        UserProfile.objects.filter(user=self.student).update(order_completed=True, pending_orders=7, pending_hours=99)
+        call_command("repair_profile_flags", stdout=io.StringIO())
+        self.assertEqual(self.state(), (False, 1, 10, 0))
+
+    def test_admin_cannot_edit_maintained_fields(self):
+        profile = UserProfile.objects.create(user=self.student, study_hours=3)
+        self.client.post(reverse("admin:api_userprofile_change", args=[profile.pk]), {
+            "user": self.student.pk, "study_hours": 4, "pending_orders": 9, "pending_hours": 9, "order_completed": "on",
+        })
+        self.assertEqual(self.state(), (False, 0, 0, 4))
+
+
+@override_settings(API_THROTTLE_RATES={"default": None})
+class WorkQueueTests(TestCase):
+    def setUp(self):
+        student = User.objects.create_user("anna")
+        now = timezone.now()
+        Reservation.objects.bulk_create([Reservation(student=student, start_time=now, end_time=now) for _ in range(5)])
+        Reservation.objects.update(created_at=now)  # Equal created_at: the id breaks the tie
+        self.ids = list(Reservation.objects.order_by("id").values_list("id", flat=True))
+        self.alice, self.bob = APIClient(), APIClient()
+        self.alice.force_authenticate(User.objects.create_superuser("alice", "alice@example.com", "pw"))
+        self.bob.force_authenticate(User.objects.create_superuser("bob", "bob@example.com", "pw"))
+
+    def listed(self, client, **params):
+        data = client.get(reverse("pending_reservations_queue"), params).data
+        return [item["id"] for item in data["results"]], data["next_cursor"]
+
+    def test_cursor_walks_items_with_equal_created_at(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = self.listed(self.alice, limit=2, **({"cursor": cursor} if cursor else {}))
+            seen += page
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.ids)
+        self.assertEqual(self.alice.get(reverse("pending_reservations_queue"), {"cursor": "bad"}).status_code, 400)
+
+    def test_claims_are_skipped_by_others_until_released_or_expired(self):
+        self.assertEqual(self.alice.get(reverse("pending_reservations_queue"), {"claim": 1}).status_code, 400)
+        claimed = self.alice.post(reverse("claim_reservations_queue"), {"limit": 2}, format="json").data
+        self.assertEqual([item["id"] for item in claimed["results"]], self.ids[:2])
+        self.assertEqual(self.listed(self.bob)[0], self.ids[2:])
+        self.assertEqual(self.listed(self.alice)[0], self.ids)  # Own leases stay visible
+        bob_claim = self.bob.post(reverse("claim_reservations_queue"), {"limit": 2}, format="json").data
+        self.assertEqual([item["id"] for item in bob_claim["results"]], self.ids[2:4])
+
+        released = self.alice.post(reverse("release_reservations_queue"), {"ids": self.ids}, format="json").data
+        self.assertEqual(released, {"released": 2})  # Only her own leases
+        self.assertEqual(self.listed(self.alice)[0], self.ids[:2] + self.ids[4:])
+
+        Reservation.objects.filter(claimed_by__username="bob").update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.listed(self.alice)[0], self.ids)  # Bob's leases expired
+
+
+    def test_malformed_bodies_get_400(self):
+        for body in [{"limit": None}, {"limit": [1]}, {"limit": "x"}, {"limit": 0}, {"cursor": 5}, [1, 2]]:
+            with self.subTest(body=body):
+                self.assertEqual(self.alice.post(reverse("claim_reservations_queue"), body, format="json").status_code, 400)
+        for body in [{"ids": "abc"}, {"ids": 5}, {"ids": ["1"]}, {"ids": [True]}, [1, 2]]:
+            with self.subTest(body=body):
+                self.assertEqual(self.alice.post(reverse("release_reservations_queue"), body, format="json").status_code, 400)
+        self.assertFalse(Reservation.objects.filter(claimed_by__isnull=False).exists())
+
+
+@override_settings(EMAIL_BACKEND="api.tests.CountingEmailBackend")
+class ExpireReservationsTests(TestCase):
+    def setUp(self):
+        self.anna = User.objects.create_user("anna", "anna@example.com", first_name="Anna")
+        self.ben = User.objects.create_user("ben", "ben@example.com", first_name="Ben")
+        past = timezone.now() - timedelta(hours=1)
+        future = timezone.now() + timedelta(days=1)
+        Reservation.objects.bulk_create(
+            [Reservation(student=self.anna, start_time=past, end_time=past) for _ in range(3)]
+            + [Reservation(student=self.ben, start_time=past, end_time=past) for _ in range(2)]
+            + [Reservation(student=self.anna, start_time=future, end_time=future),  # Not due yet
+               Reservation(student=self.ben, start_time=past, end_time=past, status="approved")]
+        )
+        CountingEmailBackend.connections = 0
+
+    def expire(self, **options):
+        call_command("expire_reservations", stdout=io.StringIO(), **options)
+
+    def test_expires_due_reservations_one_update_per_batch(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.expire(batch_size=2)
+        updates = [q["sql"] for q in queries.captured_queries if q["sql"].startswith('UPDATE "api_reservation"')]
+        self.assertEqual(len(updates), 3)  # 5 due rows in batches of 2
+        self.assertEqual(Reservation.objects.filter(status="expired").count(), 5)
+        self.assertEqual(Reservation.objects.filter(status="pending").count(), 1)
+
+    def test_expired_orders_release_the_profile_counters(self):
+        for hours, age in [(10, 40), (20, 40), (30, 5)]:
+            order = Order.objects.create(student=self.anna, hours=hours, terms_accepted=True, gdpr_accepted=True)
+            UserProfile.add_pending_order(self.anna, hours)
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=age))
+        self.expire(orders_older_than=30)
+        profile = UserProfile.objects.get(user=self.anna)
+        self.assertEqual((profile.pending_orders, profile.pending_hours), (1, 30))
+        self.assertEqual(sorted(Order.objects.values_list("status", flat=True)), ["expired", "expired", "pending"])
+
+    def test_notify_sends_one_email_per_student_over_one_connection(self):
+        Order.objects.create(student=self.anna, hours=5, terms_accepted=True, gdpr_accepted=True)
+        Order.objects.update(created_at=timezone.now() - timedelta(days=40))
+        self.expire(notify=True, orders_older_than=30, batch_size=2)
+        self.assertEqual(CountingEmailBackend.connections, 1)
+        bodies = {message.to[0]: message.body for message in mail.outbox}
+        self.assertEqual(set(bodies), {"anna@example.com", "ben@example.com"})
+        self.assertIn("- 3 pending lesson reservation(s)", bodies["anna@example.com"])
+        self.assertIn("- 1 pending study hour order(s)", bodies["anna@example.com"])
+        self.assertNotIn("study hour order", bodies["ben@example.com"])
+
+    def test_purges_tombstones_past_the_retention(self):
+        ReservationTombstone.record([(1, self.anna.pk), (2, self.anna.pk)], "deleted")
+        ReservationTombstone.objects.filter(reservation_id=1).update(
+            created_at=timezone.now() - ReservationTombstone.RETENTION - timedelta(days=1)
+        )
+        self.expire()
+        self.assertEqual(list(ReservationTombstone.objects.values_list("reservation_id", flat=True)), [2])
+
+
+@override_settings(API_THROTTLE_RATES={"default": None}, TIME_ZONE="UTC")
+class ReservationSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user("anna")
+        self.staff = APIClient()
+        self.staff.force_authenticate(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+        for start, status in [("2030-01-07T10:15", "pending"), ("2030-01-07T10:45", "approved"),
+                              ("2030-01-07T12:30", "pending"), ("2030-01-08T09:00", "rejected")]:
+            moment = timezone.make_aware(datetime.fromisoformat(start))
+            Reservation.objects.create(student=self.student, start_time=moment, end_time=moment, status=status)
+
+    def summary(self, **params):
+        return self.staff.get(reverse("reservation_summary"), params)
+
+    def counts(self, data):
+        return {bucket["start"][:16]: (bucket["pending"], bucket["approved"], bucket["rejected"]) for bucket in data["buckets"]}
+
+    def test_hour_and_day_buckets_over_an_aligned_range(self):
+        data = self.summary(start="2030-01-07T10:20:00Z", end="2030-01-07T12:40:00Z", bucket="hour").data
+        self.assertEqual((data["start"].isoformat(), data["end"].isoformat()), ("2030-01-07T10:00:00+00:00", "2030-01-07T13:00:00+00:00"))
+        self.assertEqual(self.counts(data), {"2030-01-07T10:00": (1, 1, 0), "2030-01-07T12:00": (1, 0, 0)})
+
+        data = self.summary(start="2030-01-07T12:00:00Z", end="2030-01-08T00:00:01Z").data  # Days by default
+        self.assertEqual((data["start"].isoformat(), data["end"].isoformat()), ("2030-01-07T00:00:00+00:00", "2030-01-09T00:00:00+00:00"))
+        self.assertEqual(self.counts(data), {"2030-01-07T00:00": (2, 1, 0), "2030-01-08T00:00": (0, 0, 1)})
+
+    def test_cached_until_a_reservation_write(self):
+        params = {"start": "2030-01-07T00:00:00Z", "end": "2030-01-09T00:00:00Z"}
+        self.summary(**params)
+        with self.assertNumQueries(0):
+            self.summary(start="2030-01-07T05:00:00Z", end="2030-01-08T20:00:00Z")  # Same aligned range: cache hit
+
+        student = APIClient()
+        student.force_authenticate(self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            student.post(reverse("create_reservation"), {"start_time": "2030-01-08T15:00:00Z", "end_time": "2030-01-08T16:00:00Z"}, format="json")
+        with self.assertNumQueries(1):
+            data = self.summary(**params).data
+        self.assertEqual(self.counts(data)["2030-01-08T00:00"], (1, 0, 1))
+
+    def test_invalid_requests(self):
+        for params in [{"start": "2030-01-07T00:00:00Z"}, {"start": "2030-01-08T00:00:00Z", "end": "2030-01-07T00:00:00Z"},
+                       {"start": "yesterday", "end": "2030-01-07T00:00:00Z"},
+                       {"start": "2030-01-07T00:00:00Z", "end": "2030-01-08T00:00:00Z", "bucket": "week"}]:
+            self.assertEqual(self.summary(**params).status_code, 400, params)
+        student = APIClient()
+        student.force_authenticate(self.student)
+        self.assertEqual(student.get(reverse("reservation_summary")).status_code, 403)
+
+
+@override_settings(API_THROTTLE_RATES={"default": None}, PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0,
+                   PROFILING_TARGETS=[], PROFILING_USER_IDS=[], PROFILING_TOKEN="secret", PROFILING_MAX_FILES=200)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        override = override_settings(PROFILING_DIR=Path(tmpdir.name))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.dir = Path(tmpdir.name)
+        self.student = User.objects.create_user("anna")
+        self.api = APIClient(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.student)}")
+
+    def profiles(self):
+        return sorted(path.name.split("-", 4)[4] for path in self.dir.glob("*.prof"))  # Drops the time and pid prefix
+
+    def test_samples_by_target_user_and_header(self):
+        with override_settings(PROFILING_TARGETS=["get_user_profile"]):
+            self.api.get(reverse("get_user_profile"))
+            self.api.get(reverse("list_reservations"))
+        self.assertEqual(self.profiles(), ["GET-get_user_profile.prof"])
+
+        other = User.objects.create_user("ben")
+        with override_settings(PROFILING_USER_IDS=[str(other.pk)]):
+            self.api.get(reverse("list_reservations"))  # JWT user read from the token
+        self.assertEqual(len(self.profiles()), 1)
+        with override_settings(PROFILING_USER_IDS=[str(self.student.pk)]):
+            self.api.get(reverse("list_reservations"))
+        self.assertEqual(len(self.profiles()), 2)
+
+        with override_settings(PROFILING_SAMPLE_RATE=0.0):
+            self.api.get(reverse("reservation_summary"))
+            self.api.get(reverse("reservation_summary"), HTTP_X_PROFILE="wrong")
+            self.api.get(reverse("reservation_summary"), HTTP_X_PROFILE="secret")  # Always profiled
+        self.assertEqual(self.profiles().count("GET-reservation_summary.prof"), 1)
+
+    def test_admin_actions_are_profiled_once(self):
+        self.client.force_login(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+        now = timezone.now()
+        reservation = Reservation.objects.create(student=self.student, start_time=now, end_time=now)
+        post = {"action": "reject_reservations", "_selected_action": [reservation.pk]}
+        self.client.post(reverse("admin:api_reservation_changelist"), post)
+        self.assertEqual(self.profiles(), ["POST-api_reservation_changelist.prof"])  # The action is not nested
+
+        with override_settings(PROFILING_TARGETS=["reject_reservations"]):
+            self.client.post(reverse("admin:api_reservation_changelist"), post)
+        self.assertEqual(self.profiles(), ["POST-api_reservation_changelist.prof", "admin-reject_reservations.prof"])
+
+    def test_busy_or_failing_profiler_never_fails_the_request(self):
+        # Another thread's profiler holds the process-wide lock: the request runs unprofiled
+        with profiling._profiler_lock:
+            self.assertEqual(self.api.get(reverse("list_reservations"), HTTP_X_PROFILE="secret").status_code, 200)
+        self.assertEqual(self.profiles(), [])
+
+        with mock.patch.object(cProfile.Profile, "enable", side_effect=ValueError("Another profiling tool is already active")):
+            self.assertEqual(self.api.get(reverse("list_reservations"), HTTP_X_PROFILE="secret").status_code, 200)
+        self.assertEqual(self.profiles(), [])
+
+        with mock.patch("api.profiling.save_profile", side_effect=OSError("disk full")), \
+                self.assertLogs("api.profiling", "ERROR"):
+            self.assertEqual(self.api.get(reverse("list_reservations"), HTTP_X_PROFILE="secret").status_code, 200)
+        self.assertFalse(profiling._profiler_lock.locked())
+        self.api.get(reverse("list_reservations"), HTTP_X_PROFILE="secret")
+        self.assertEqual(self.profiles(), ["GET-list_reservations.prof"])
+
+    @override_settings(PROFILING_MAX_FILES=2)
+    def test_rotation_and_summary(self):
+        for _ in range(3):
+            self.api.get(reverse("get_user_profile"))
+        self.assertEqual(len(self.profiles()), 2)
+
+        out = io.StringIO()
+        call_command("profile_summary", match="get_user_profile", limit=5, stdout=out)
+        self.assertIn("Aggregated 2 profiles", out.getvalue())
+        self.assertIn("get_user_profile", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("profile_summary", match="nothing", stdout=io.StringIO())
+
+
+@override_settings(API_THROTTLE_RATES={"default": None})
+class OrderEmailTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user("anna")
+        self.api = APIClient()
+        self.api.force_authenticate(self.student)
+        User.objects.create_user("ben", email="ben@example.com")  # Indexed by the post_save handler
+
+    def order(self, email):
+        return self.api.post(reverse("create_order"), {
+            "first_name": "Anna", "last_name": "K", "email": email, "phone": "1", "address": "x",
+            "hours": 10, "terms_accepted": True, "gdpr_accepted": True,
+        }, format="json")
+
+    def test_duplicate_email_is_rejected_case_insensitively(self):
+        response = self.order("  BEN@Example.com ")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("email", response.data)
+        self.assertFalse(Order.objects.exists())
+
+    def test_order_syncs_the_normalized_email(self):
+        self.assertEqual(self.order("Anna@Example.COM").status_code, 201)
+        self.assertEqual(UserProfile.objects.get(user=self.student).email_normalized, "anna@example.com")
+
+    def test_emails_changed_outside_orders_are_indexed(self):
+        staff = User.objects.create_superuser("staff", "Staff@Example.com", "pw")  # As by createsuperuser
+        self.assertEqual(self.order("staff@example.com").status_code, 400)
+
+        staff.email = "office@example.com"  # As from the admin user form or the shell
+        staff.save()
+        self.assertEqual(self.order("office@example.com").status_code, 400)
+        staff.email = ""
+        staff.save()
+        self.assertIsNone(UserProfile.objects.get(user=staff).email_normalized)
+
+        # A duplicate saved outside create_order is stored but leaves the address with its first owner
+        carl = User.objects.create_user("carl", email="BEN@example.com")
+        self.assertFalse(UserProfile.objects.filter(user=carl).exists())
+        self.assertEqual(UserProfile.objects.get(email_normalized="ben@example.com").user.username, "ben")
+        self.assertEqual(self.order("Staff@example.com").status_code, 201)  # Released by the change above
+
+    def test_concurrent_duplicate_returns_400(self):
+        # The email is taken between validation and save, so the order cannot index it
+        with mock.patch("api.serializers.OrderSerializer.validate_email", side_effect=lambda value: value):
+            response = self.order("Ben@example.com")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"email": ["This email address is already in use. Please use a different one."]})
+        self.assertFalse(Order.objects.exists())  # Rolled back with the profile update
+        self.assertEqual(User.objects.get(pk=self.student.pk).email, "")
+
+
+class SharedCacheCheckTests(TestCase):
+    def test_warns_about_a_per_process_cache_outside_tests(self):
+        with override_settings(TESTING=False):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ["api.W001"])
+            redis = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://127.0.0.1:6379/1"}}
+            with override_settings(CACHES=redis):
+                self.assertEqual(check_shared_cache(None), [])
+        self.assertEqual(check_shared_cache(None), [])  # The test suite runs on locmem
@@ -0,0 +1,118 @@
+# backend/api/throttling.py
+
+'''
+Token-bucket throttling for the API:
+1. `TokenBucketThrottle`: DRF throttle applied to every API view through `DEFAULT_THROTTLE_CLASSES`.
+2. Rates are configured per URL name in `API_THROTTLE_RATES` (e.g. `"create_reservation": "10/min"`),
+   with a `"default"` entry for unlisted views. A rate of `None` disables throttling for that view.
+3. Buckets are scoped per URL name and per user (authenticated) or client IP (anonymous), and live
+   in the shared cache named by `API_THROTTLE_CACHE`.
+4. Each check is O(1): the bucket is stored as a single "theoretical arrival time" integer (GCRA)
+   advanced with an atomic cache `incr`. The one exception is restarting an idle bucket from the
+   current time, a plain `set`: a concurrent request of the same client landing between the `incr`
+   and that `set` is not counted. This only happens on a client's first requests after idling,
+   and costs at most one extra allowed request per race.
+5. `SessionThrottle`: for `/api/session/`, which runs without authentication, buckets are scoped by the
+   user of a valid refresh token in the body, so students behind one NAT or proxy don't share a bucket.
+6. Every decision is logged to the `api.throttling` logger (denials at WARNING).
+'''
+
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+logger = logging.getLogger(__name__)
+
+MICROSECONDS = 1_000_000
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    # Parses "<requests>/<period>" (period: s, sec, m, min, h, hour, d, day) into (requests, seconds)
+    if rate is None:
+        return None
+    num, period = rate.split("/")
+    return int(num), PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    def __init__(self):
+        self.cache = caches[getattr(settings, "API_THROTTLE_CACHE", "default")]
+        self.rates = getattr(settings, "API_THROTTLE_RATES", {})
+        self.wait_seconds = None
+
+    def get_scope(self, request, view):
+        # URL name from `api/urls.py` (or the project urls), falling back to the view name
+        match = getattr(request, "resolver_match", None)
+        if match is not None and match.url_name:
+            return match.url_name
+        return view.__class__.__name__
+
+    def get_rate(self, scope):
+        return parse_rate(self.rates.get(scope, self.rates.get("default")))
+
+    def get_cache_key(self, request, scope):
+        if request.user and request.user.is_authenticated:
+            return f"throttle:{scope}:user:{request.user.pk}"
+        return f"throttle:{scope}:ip:{self.get_ident(request)}"
+
+    def _advance(self, key, interval, now, timeout):
+        # Atomically advances the bucket by one request and returns the new arrival time
+        try:
+            return self.cache.incr(key, interval)
+        except ValueError:
+            if self.cache.add(key, now + interval, timeout):
+                return now + interval
+            return self.cache.incr(key, interval)
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        rate = self.get_rate(scope)
+        if rate is None:
+            return True
+
+        requests, period = rate
+        interval = period * MICROSECONDS // requests  # Time to refill one token
+        burst = requests * interval  # Bucket capacity expressed as time
+        timeout = period + 60
+        key = self.get_cache_key(request, scope)
+        now = int(time.time() * MICROSECONDS)
+
+        tat = self._advance(key, interval, now, timeout)
+        if tat < now + interval:
+            # The bucket was full (idle client); restart it from now. Not atomic with the `incr` above,
+            # so a racing request of the same client may go uncounted (see the module docstring)
+            tat = now + interval
+            self.cache.set(key, tat, timeout)
+
+        if tat - now > burst:
+            self.cache.decr(key, interval)  # Denied requests don't consume a token
+            self.wait_seconds = (tat - burst - now) / MICROSECONDS
+            logger.warning("Throttled %s (wait %.2fs)", key, self.wait_seconds)
+            return False
+
+        self.cache.touch(key, timeout)
+        logger.debug("Allowed %s (%d tokens left)", key, (burst - (tat - now)) // interval)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class SessionThrottle(TokenBucketThrottle):
+    def get_cache_key(self, request, scope):
+        # The refresh token is only decoded here (signature and expiry); invalid tokens fall back to the client IP
+        raw_token = request.data.get("refresh") if hasattr(request.data, "get") else None
+        if raw_token:
+            try:
+                user_id = RefreshToken(raw_token).payload.get(jwt_settings.USER_ID_CLAIM)
+                return f"throttle:{scope}:user:{user_id}"
+            except TokenError:
+                pass
+        return super().get_cache_key(request, scope)
@@ -2,27 +2,43 @@
 
 '''
 Defines URL patterns for API endpoints:
-1. User tracking, study hours retrieval, and profile access.
-2. Reservation management: creation, listing, status updates, hiding rejected, and deletion.
+1. User tracking, study hours retrieval, profile access, and the combined session refresh.
+2. Reservation management: creation, listing, staff summary, status updates, hiding rejected, deletion,
+   and the students' ICS calendar feed.
 3. Order management: creating orders and updating study hour orders.
+4. Staff work queues: keyset-paginated pending reservations and orders with claim/release of leases.
+5. Staff diagnostics: recorded slow queries.
 
 Each URL is linked to a specific view, enabling core functionalities for users, reservations, and orders.
 '''
 
 from django.urls import path
 from .views import (add_to_active_users_view, get_study_hours, create_reservation, list_reservations, 
-                    update_reservation_status, hide_rejected_reservations, delete_reservation, create_order, get_user_profile, create_hour_order)
+                    update_reservation_status, hide_rejected_reservations, delete_reservation, create_order, get_user_profile, create_hour_order,
+                    reservation_summary, pending_queue, claim_queue_items, release_queue_items, calendar_feed, calendar_feed_token,
+                    slow_queries, session)
 
 urlpatterns = [
     path("user/login/track/", add_to_active_users_view, name="track_login"),
     path("user/study_hours/", get_study_hours, name="get_study_hours"),
     path("reservation/create/", create_reservation, name="create_reservation"),
     path("reservations/", list_reservations, name="list_reservations"),
+    path("reservations/summary/", reservation_summary, name="reservation_summary"),
     path("reservation/<int:pk>/update/", update_reservation_status, name="update_reservation_status"),
     path("reservations/hide_rejected/", hide_rejected_reservations, name="hide_rejected_reservations"),
     path("reservation/<int:pk>/", delete_reservation, name="delete_reservation"), 
+    path("calendar/token/", calendar_feed_token, name="calendar_feed_token"),
+    path("calendar/<str:token>.ics", calendar_feed, name="calendar_feed"),
     path('order/create/', create_order, name='create_order'),
     path('user/profile/', get_user_profile, name='get_user_profile'),
+    path('session/', session, name='session'),
     path('order/update/', create_hour_order, name='create_hour_order'),
+    path('slow-queries/', slow_queries, name='slow_queries'),
+    path('queue/reservations/', pending_queue, {'kind': 'reservations'}, name='pending_reservations_queue'),
+    path('queue/orders/', pending_queue, {'kind': 'orders'}, name='pending_orders_queue'),
+    path('queue/reservations/claim/', claim_queue_items, {'kind': 'reservations'}, name='claim_reservations_queue'),
+    path('queue/orders/claim/', claim_queue_items, {'kind': 'orders'}, name='claim_orders_queue'),
+    path('queue/reservations/release/', release_queue_items, {'kind': 'reservations'}, name='release_reservations_queue'),
+    path('queue/orders/release/', release_queue_items, {'kind': 'orders'}, name='release_orders_queue'),
 ]
 
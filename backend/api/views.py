@@ -6,27 +6,52 @@ and study hours tracking within the learning platform. Key functionalities inclu
 
 1. **User and Profile Management**:
    - `CreateUserView`: Allows new user registration.
-   - `get_user_profile`: Fetches user-specific details like order status (completed or pending).
+   - `get_user_profile`: Fetches user-specific details like order status (completed or pending) from the
+     order state denormalized on `UserProfile`.
 
 2. **Order Management**:
    - `create_order` and `create_hour_order`: Handle order creation for study hours with terms validation.
-   - Automatically updates user details and manages pending or approved order statuses.
+   - Automatically updates user details and manages pending or approved order statuses,
+     keeping the pending order counters on `UserProfile` in the same transaction.
+   - Keeps the normalized email on `UserProfile` in sync so email validation is a single index probe.
 
 3. **Reservation Handling**:
    - `create_reservation`: Allows users to book lessons with a default "pending" status.
    - `delete_reservation`: Enables users to delete their pending reservations.
    - `list_reservations`: Lists reservations; admins can view all, while users see their own unhidden reservations.
+     With `?since=<token>` it returns only the rows changed and the ids deleted or hidden since the token,
+     and `?start=&end=` limits it to a window of start times.
+   - `reservation_summary`: Admin-only counts of reservations per hour or day and status, cached until the next write.
    - `update_reservation_status`: Admin functionality to approve or reject reservations with automatic deduction of study hours on approval.
    - `hide_rejected_reservations`: Hides rejected reservations from the user's view.
+   - `calendar_feed`: Token-addressed ICS feed of a student's lessons for calendar apps, cached until the
+     student's reservations change and answered with 304s to conditional polls. `calendar_feed_token`
+     returns (or with POST, rotates) the feed URL.
 
-4. **Study Hours Management**:
+4. **Slow Queries**:
+   - `slow_queries`: Staff JSON view of the recorded slow queries and the top fingerprints by total time.
+
+5. **Staff Work Queues**:
+   - `pending_queue`: Keyset-paginated "next N pending" reservations or orders. `claim_queue_items` (POST)
+     returns the same page and leases it, so several admins don't work the same item. `release_queue_items`
+     gives leases back.
+
+6. **Sessions**:
+   - `session`: Refreshes the JWT pair, tracks the activity and returns the profile flags and study hours
+     in one request, for the frontend's login and periodic token refresh.
+
+7. **Study Hours Management**:
    - `get_study_hours`: Retrieves available study hours for logged-in users.
    - Updates study hours upon order approval or reservation processing.
 
-5. **Active User Tracking**:
+8. **Active User Tracking**:
    - `add_to_active_users_view`: Tracks user login activity by managing `ActiveUser` records.
 
-6. **Error Handling**:
+9. **Idempotent Creation**:
+   - `create_order`, `create_hour_order` and `create_reservation` honour the `Idempotency-Key` header,
+     replaying the first response to client retries instead of creating duplicates.
+
+10. **Error Handling**:
    - Implements comprehensive error messages and status codes for better user experience.
    - Handles exceptions like insufficient study hours, invalid data, or missing profiles.
 
@@ -40,11 +65,34 @@ from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from .serializers import UserSerializer, ReservationSerializer, OrderSerializer
 from rest_framework.exceptions import ValidationError
-from .models import ActiveUser, UserProfile, Reservation, Order
+from .models import ActiveUser, UserProfile, Reservation, ReservationTombstone, Order, normalize_email
+from .idempotency import idempotent
+from .querybudget import query_budget
+from .throttling import SessionThrottle
+from .summary import BUCKETS, get_reservation_summary, invalidate_reservation_summary
+from .notifications import record_notifications
+from .slowqueries import recent_slow_queries, top_offenders
+from .calendar_feed import (feed_etag, feed_last_modified, get_cached_feed, get_feed, get_or_create_calendar_token,
+                            stream_feed)
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models import Q
+from datetime import datetime, timedelta, timezone as dt_timezone
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
 
 # Class-based view for creating a new user
 class CreateUserView(generics.CreateAPIView):
@@ -52,8 +100,10 @@ class CreateUserView(generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [AllowAny]  # Allows any user to access this endpoint for registration
 
+@query_budget(4)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_reservation(request):
     # Creates a new reservation with a default status of "pending"
     data = request.data
@@ -64,8 +114,10 @@ def create_reservation(request):
         status='pending'
     )
     reservation.save()
+    transaction.on_commit(invalidate_reservation_summary)
     return Response({"message": "Reservation created", "id": reservation.id}, status=status.HTTP_201_CREATED)
 
+@query_budget(6)
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_reservation(request, pk):
@@ -73,7 +125,10 @@ def delete_reservation(request, pk):
     try:
         reservation = Reservation.objects.get(pk=pk, student=request.user)
         if reservation.status == 'pending':
-            reservation.delete()
+            with transaction.atomic():
+                ReservationTombstone.record([(reservation.pk, reservation.student_id)], 'deleted')
+                reservation.delete()
+            transaction.on_commit(invalidate_reservation_summary)
             return Response({"message": "Reservation deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
         else:
             return Response({"error": "Only pending reservations can be deleted."}, status=status.HTTP_403_FORBIDDEN)
@@ -82,64 +137,302 @@ def delete_reservation(request, pk):
 
 
 
+@query_budget(6)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def hide_rejected_reservations(request):
-    # Hides all rejected reservations for the current user
-    Reservation.objects.filter(
-        student=request.user,
-        status='rejected'
-    ).update(hidden_for_student=True)
+    # Hides all rejected reservations for the current user and logs them for the delta sync
+    with transaction.atomic():
+        hidden_ids = list(Reservation.objects.filter(
+            student=request.user,
+            status='rejected',
+            hidden_for_student=False
+        ).values_list('id', flat=True))
+        Reservation.objects.filter(id__in=hidden_ids).update(hidden_for_student=True, updated_at=timezone.now())
+        ReservationTombstone.record([(pk, request.user.pk) for pk in hidden_ids], 'hidden')
     return Response({"message": "Rejected reservations hidden"})
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_reservations(request):
-    # Lists all reservations; admin can see all, while users see their own unhidden reservations
+    # Lists all reservations; admin can see all, while users see their own unhidden reservations.
+    # With `?since=<token>` only the rows changed and the ids removed since that token are returned.
     if request.user.is_staff:
         reservations = Reservation.objects.all()
+        tombstones = ReservationTombstone.objects.filter(reason='deleted')  # Staff still see hidden rows
     else:
         reservations = Reservation.objects.filter(
             student=request.user,
             hidden_for_student=False
         )
-    serializer = ReservationSerializer(reservations, many=True)
-    return Response(serializer.data)
+        tombstones = ReservationTombstone.objects.filter(student=request.user)
+
+    # Optional `?start=&end=` window on start_time, used to drill down from the summary
+    try:
+        window_start, window_end = parse_window(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if window_start is not None:
+        reservations = reservations.filter(start_time__gte=window_start)
+    if window_end is not None:
+        reservations = reservations.filter(start_time__lt=window_end)
+
+    # Back-dated by SYNC_TOKEN_SAFETY_MARGIN: `updated_at` is set before commit, so a write still committing
+    # while this request queries must fall into the next delta. Deltas overlap; clients merge rows by id.
+    token = make_sync_token(timezone.now() - timedelta(seconds=settings.SYNC_TOKEN_SAFETY_MARGIN))
+
+    since = request.query_params.get("since")
+    if since is None:
+        serializer = ReservationSerializer(reservations, many=True)
+        response = Response(serializer.data)
+        response["X-Sync-Token"] = token
+        return response
+
+    try:
+        since = parse_sync_token(since)
+    except (ValueError, OverflowError, OSError):  # Non-numeric or out of the datetime range
+        return Response({"error": "Invalid sync token."}, status=status.HTTP_400_BAD_REQUEST)
+    if since < timezone.now() - ReservationTombstone.RETENTION:
+        return Response({"error": "Sync token expired, reload all reservations."}, status=status.HTTP_410_GONE)
+
+    changed = ReservationSerializer(reservations.filter(updated_at__gt=since), many=True)
+    removed = tombstones.filter(created_at__gt=since).values_list('reservation_id', flat=True)
+    return Response({"changed": changed.data, "removed": list(removed), "token": token})
+
+@query_budget(2)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def reservation_summary(request):
+    # Counts reservations per hour or day and status between `start` and `end`, for the staff overview
+    try:
+        start, end = parse_window(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    bucket = request.query_params.get("bucket", "day")
+    if start is None or end is None or start >= end:
+        return Response({"error": "Both start and end are required, with start before end."}, status=status.HTTP_400_BAD_REQUEST)
+    if bucket not in BUCKETS:
+        return Response({"error": "bucket must be 'hour' or 'day'."}, status=status.HTTP_400_BAD_REQUEST)
+
+    start, end, buckets = get_reservation_summary(timezone.localtime(start), timezone.localtime(end), bucket)
+    return Response({"bucket": bucket, "start": start, "end": end, "buckets": buckets})
+
+
+@query_budget(4)
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def calendar_feed_token(request):
+    # Returns the user's calendar subscription URLs; POST issues a new token, revoking the old URLs
+    token = get_or_create_calendar_token(request.user, rotate=request.method == 'POST')
+    url = request.build_absolute_uri(reverse("calendar_feed", kwargs={"token": token}))
+    return Response({"url": url, "webcal_url": "webcal://" + url.split("://", 1)[1]})
+
+
+# Plain Django view: calendar apps send no credentials and may ask for `Accept: text/calendar` only
+@query_budget(2)
+@require_safe
+def calendar_feed(request, token):
+    # ICS feed of the student's pending and approved reservations. Conditional polls get a 304 as long as
+    # the student's reservations are unchanged; otherwise the feed comes from the cache or is streamed.
+    feed = get_feed(token)
+    if feed is None:
+        return JsonResponse({"error": "Calendar feed not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    user_id, version = feed
+    etag = feed_etag(user_id, version)
+    response = get_conditional_response(request, etag=etag, last_modified=version // 1_000_000_000)
+    if response is None:
+        cached = get_cached_feed(user_id, version)
+        if cached is not None:
+            response = HttpResponse(cached, content_type="text/calendar; charset=utf-8")
+        else:
+            response = StreamingHttpResponse(stream_feed(user_id, version), content_type="text/calendar; charset=utf-8")
+    response["ETag"] = etag
+    response["Last-Modified"] = feed_last_modified(version)
+    patch_cache_control(response, private=True, no_cache=True)  # Always revalidate; a 304 is cheap
+    return response
+
+
+@query_budget(1)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def slow_queries(request):
+    # Staff JSON view of the slow-query ring buffer: top fingerprints by total time and the latest entries
+    entries = recent_slow_queries()
+    return Response({
+        "enabled": settings.SLOW_QUERY_ENABLED,
+        "threshold_ms": settings.SLOW_QUERY_THRESHOLD_MS,
+        "top": top_offenders(entries),
+        "queries": entries,
+    })
+
+
+def parse_window(params):
+    # Parses the optional ISO 8601 `start` and `end` query parameters into aware datetimes
+    window = []
+    for name in ("start", "end"):
+        value = params.get(name)
+        if value is None:
+            window.append(None)
+            continue
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f"Invalid {name} datetime.")
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        window.append(moment)
+    return window
+
+
+# Pending work queues for staff: model and serializer per queue kind
+WORK_QUEUES = {
+    "reservations": (Reservation, ReservationSerializer),
+    "orders": (Order, OrderSerializer),
+}
+
+
+def queue_page(request, params, kind):
+    # Pending items of the queue after the cursor in `params`, ordered by (created_at, id), with the page size.
+    # A keyset condition instead of OFFSET makes every page one index range scan on (status, created_at).
+    # Items leased to another staff member are skipped. Raises ValueError, TypeError or AttributeError for
+    # a malformed limit, cursor or body (e.g. `"limit": null`, a numeric cursor or a JSON array).
+    model = WORK_QUEUES[kind][0]
+    limit = min(int(params.get("limit", 20)), 100)
+    cursor = params.get("cursor")
+    after = parse_queue_cursor(cursor) if cursor else None
+    if limit <= 0:
+        raise ValueError("Invalid limit")
+
+    items = model.objects.filter(status='pending').filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lte=timezone.now()) | Q(claimed_by=request.user)
+    )
+    if after is not None:
+        created_at, pk = after
+        items = items.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+    return items.order_by('created_at', 'pk'), limit
+
+
+def queue_response(page, limit, kind):
+    has_more = len(page) > limit
+    page = page[:limit]
+    next_cursor = make_queue_cursor(page[-1]) if has_more else None
+    return Response({"results": WORK_QUEUES[kind][1](page, many=True).data, "next_cursor": next_cursor})
+
+
+@query_budget(5)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def pending_queue(request, kind):
+    # Next `limit` pending items after `cursor`, without leasing them
+    if "claim" in request.query_params:
+        return Response({"error": "Claim items with a POST to the queue's claim/ endpoint."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        items, limit = queue_page(request, request.query_params, kind)
+    except (ValueError, TypeError, AttributeError):
+        return Response({"error": "Invalid limit or cursor."}, status=status.HTTP_400_BAD_REQUEST)
+    return queue_response(list(items[:limit + 1]), limit, kind)
+
+
+@query_budget(5)
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def claim_queue_items(request, kind):
+    # Like `pending_queue`, but leases the returned items to the requesting staff member for
+    # WORK_QUEUE_LEASE_SECONDS. A POST, so retrying clients and prefetchers never re-lease items.
+    try:
+        items, limit = queue_page(request, request.data, kind)
+    except (ValueError, TypeError, AttributeError):
+        return Response({"error": "Invalid limit or cursor."}, status=status.HTTP_400_BAD_REQUEST)
+    model = WORK_QUEUES[kind][0]
+    with transaction.atomic():
+        # Rows another admin is claiming right now are skipped rather than waited for
+        page = list(items.select_for_update(skip_locked=True)[:limit + 1])
+        lease_until = timezone.now() + timedelta(seconds=settings.WORK_QUEUE_LEASE_SECONDS)
+        model.objects.filter(pk__in=[item.pk for item in page[:limit]]).update(claimed_by=request.user, claimed_until=lease_until)
+    return queue_response(page, limit, kind)
+
+
+@query_budget(2)
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def release_queue_items(request, kind):
+    # Gives up the requesting staff member's leases on the given ids
+    model = WORK_QUEUES[kind][0]
+    ids = request.data.get("ids", []) if isinstance(request.data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+        return Response({"error": "ids must be a list of integers."}, status=status.HTTP_400_BAD_REQUEST)
+    released = model.objects.filter(pk__in=ids, claimed_by=request.user).update(claimed_by=None, claimed_until=None)
+    return Response({"released": released})
+
+
+def make_queue_cursor(item):
+    raw = f"{item.created_at.isoformat()}|{item.pk}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def parse_queue_cursor(cursor):
+    try:
+        created_at, pk = urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    moment = parse_datetime(created_at)
+    if moment is None:
+        raise ValueError("Invalid cursor")
+    return moment, int(pk)
+
+
+def make_sync_token(moment):
+    # Opaque delta-sync token: the moment as integer microseconds since the epoch
+    return str(int(moment.timestamp() * 1_000_000))
+
 
+def parse_sync_token(token):
+    return datetime.fromtimestamp(int(token) / 1_000_000, tz=dt_timezone.utc)
+
+
+@query_budget(8)
 @api_view(['PATCH'])
 @permission_classes([IsAdminUser])
 def update_reservation_status(request, pk):
     # Updates the status of a reservation to either "approved" or "rejected"
     try:
-        reservation = Reservation.objects.get(pk=pk)
-        new_status = request.data.get("status")
-
-        if new_status == "approved":
-            # Approve reservation if the user has available study hours
-            try:
-                user_profile = UserProfile.objects.get(user=reservation.student)
-            except UserProfile.DoesNotExist:
-                return Response({"error": "User profile not found"}, status=status.HTTP_404_NOT_FOUND)
-
-            if user_profile.study_hours > 0:
-                reservation.status = "approved"
+        with transaction.atomic():
+            # Locked like in the admin `approve_reservations` action, so concurrent approvals deduct hours once each
+            reservation = Reservation.objects.select_for_update().get(pk=pk)
+            new_status = request.data.get("status")
+
+            if new_status == "approved":
+                # Approve reservation if the user has available study hours
+                try:
+                    user_profile = UserProfile.objects.select_for_update().get(user_id=reservation.student_id)
+                except UserProfile.DoesNotExist:
+                    return Response({"error": "User profile not found"}, status=status.HTTP_404_NOT_FOUND)
+
+                if user_profile.study_hours > 0:
+                    reservation.status = "approved"
+                    reservation.save()
+                    user_profile.study_hours -= 1  # Deduct one study hour upon approval
+                    user_profile.save(update_fields=["study_hours"])
+                    record_notifications('reservation_approved', [
+                        (reservation.student_id, {'start_time': reservation.start_time.isoformat()})
+                    ])
+                else:
+                    return Response({"error": "Insufficient study hours for approval"}, status=status.HTTP_400_BAD_REQUEST)
+
+            elif new_status == "rejected":
+                reservation.status = "rejected"
                 reservation.save()
-                user_profile.study_hours -= 1  # Deduct one study hour upon approval
-                user_profile.save()
             else:
-                return Response({"error": "Insufficient study hours for approval"}, status=status.HTTP_400_BAD_REQUEST)
-
-        elif new_status == "rejected":
-            reservation.status = "rejected"
-            reservation.save()
-        else:
-            return Response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
 
+        transaction.on_commit(invalidate_reservation_summary)
         return Response({"message": "Reservation status updated successfully", "status": reservation.status}, status=status.HTTP_200_OK)
 
     except Reservation.DoesNotExist:
         return Response({"error": "Reservation not found"}, status=status.HTTP_404_NOT_FOUND)
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_study_hours(request):
@@ -147,6 +440,7 @@ def get_study_hours(request):
     user_profile = UserProfile.objects.get(user=request.user)
     return Response({"study_hours": user_profile.study_hours})
 
+@query_budget(6)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_to_active_users_view(request):
@@ -158,29 +452,40 @@ def add_to_active_users_view(request):
         return Response({"status": "User tracked as active"})
     return Response({"status": "Unauthorized"}, status=401)
 
+@query_budget(15)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_order(request):
     data = request.data
     serializer = OrderSerializer(data=data)
     
     if serializer.is_valid():
         try:
-            # Save the order with `approved=False`
-            order = serializer.save(student=request.user, approved=False)
-
-            # Update data in the User model
-            user = request.user
-            user.first_name = data.get('first_name', '')
-            user.last_name = data.get('last_name', '')
-            user.email = data.get('email', '')
-            user.save()
+            with transaction.atomic():
+                # Save the order with `approved=False`
+                order = serializer.save(student=request.user, approved=False)
+
+                # Update data in the User model
+                user = request.user
+                user.first_name = data.get('first_name', '')
+                user.last_name = data.get('last_name', '')
+                user.email = data.get('email', '')
+                user.save()  # The post_save handler indexes the email, unless another user holds it
+
+                email = normalize_email(user.email)
+                if email is not None and not UserProfile.objects.filter(user=user, email_normalized=email).exists():
+                    raise IntegrityError("email_normalized")
+                UserProfile.add_pending_order(user, order.hours)
 
             # Send welcome email
             send_welcome_email(order)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        
+
+        except IntegrityError:
+            # A concurrent order claimed the same email between validation and save
+            return Response({"email": ["This email address is already in use. Please use a different one."]}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             print(f"Error creating order: {e}")
             return Response({"error": "An internal server error occurred while processing the order."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -188,32 +493,85 @@ def create_order(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_profile(request):
     try:
-        # Checking if a user has an approved order
-        approved_order_exists = Order.objects.filter(student=request.user, status='approved').exists()
-
-        # Checking if there is a new "pending" order
-        pending_order_exists = Order.objects.filter(student=request.user, status='pending').exists()
-
-        # If there is an approved order but also a new "pending" order, prioritize the approved one.
-        order_pending = pending_order_exists and not approved_order_exists
+        # Order state is denormalized on UserProfile, so this is a single indexed read
+        profile = UserProfile.objects.filter(user=request.user).first() or UserProfile(user=request.user)
 
         profile_data = {
             "username": request.user.username,
-            "order_completed": approved_order_exists,
-            "order_pending": order_pending,
+            "order_completed": profile.order_completed,
+            "order_pending": profile.order_pending,
+            "pending_hours": profile.pending_hours,
         }
         return Response(profile_data, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def get_session_user(user_id):
+    # (username, is_active) of a token's user, cached for SESSION_USER_CACHE_TIMEOUT seconds
+    key = f"session_user:{user_id}"
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.filter(pk=user_id).values_list("username", "is_active").first() or ("", False)
+        cache.set(key, user, settings.SESSION_USER_CACHE_TIMEOUT)
+    return user
+
+
+@query_budget(7)  # 4 once the ActiveUser row exists
+@api_view(['POST'])
+@authentication_classes([])  # The refresh token in the body is the credential
+@permission_classes([AllowAny])
+@throttle_classes([SessionThrottle])  # Buckets per token user, not per (possibly shared) client IP
+def session(request):
+    # Refreshes the JWT pair, records the activity and returns the profile state in one round trip,
+    # replacing token refresh + login tracking + profile requests. The refresh token is verified by
+    # signature and expiry only; the user check comes from a short-lived cache.
+    raw_token = request.data.get("refresh")
+    if not raw_token:
+        return Response({"error": "A refresh token is required."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        refresh = RefreshToken(raw_token)
+    except TokenError:
+        return Response({"error": "Invalid or expired refresh token."}, status=status.HTTP_401_UNAUTHORIZED)
+    user_id = refresh.payload.get(jwt_settings.USER_ID_CLAIM)
+    username, is_active = get_session_user(user_id)
+    if not is_active:
+        return Response({"error": "No active account found for the given token."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    # Same rotation as TokenRefreshView
+    tokens = {"access": str(refresh.access_token)}
+    if jwt_settings.ROTATE_REFRESH_TOKENS:
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+        refresh.outstand()
+        tokens["refresh"] = str(refresh)
+
+    # Track the activity with a single UPDATE; the ActiveUser row is only created on the first session
+    if not ActiveUser.objects.filter(user_id=user_id).update(last_login=timezone.now()):
+        ActiveUser.objects.get_or_create(user_id=user_id)
+
+    profile = UserProfile.objects.filter(user_id=user_id).first() or UserProfile(user_id=user_id)
+    return Response({
+        **tokens,
+        "username": username,
+        "order_completed": profile.order_completed,
+        "order_pending": profile.order_pending,
+        "pending_hours": profile.pending_hours,
+        "study_hours": profile.study_hours,
+    })
+
+
 # New order for hours   
+@query_budget(8)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_hour_order(request):
     try:
         hours = int(request.data.get('hours', 0))
@@ -224,17 +582,19 @@ def create_hour_order(request):
         terms_accepted = request.data.get('terms_accepted', True)
         gdpr_accepted = request.data.get('gdpr_accepted', True)
 
-        order = Order.objects.create(
-            student=request.user,
-            first_name=request.user.first_name,
-            last_name=request.user.last_name,
-            email=request.user.email,
-            hours=hours,
-            status='pending',
-            approved=False,
-            terms_accepted=terms_accepted,
-            gdpr_accepted=gdpr_accepted
-        )
+        with transaction.atomic():
+            order = Order.objects.create(
+                student=request.user,
+                first_name=request.user.first_name,
+                last_name=request.user.last_name,
+                email=request.user.email,
+                hours=hours,
+                status='pending',
+                approved=False,
+                terms_accepted=terms_accepted,
+                gdpr_accepted=gdpr_accepted
+            )
+            UserProfile.add_pending_order(request.user, hours)
         serializer = OrderSerializer(order)
         send_email_new_order(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -13,7 +13,10 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
+from django.core.exceptions import ImproperlyConfigured
 import os
+import sys
 
 load_dotenv()
 
@@ -39,6 +42,86 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",  
     ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "api.throttling.TokenBucketThrottle",
+    ],
+}
+
+# Token-bucket rates per URL name ("<requests>/<period>"); "default" covers unlisted views
+API_THROTTLE_RATES = {
+    "default": "120/min",
+    "get_token": "10/min",
+    "session": "20/min",  # Per refresh-token user (SessionThrottle), not per client IP
+    "register": "5/min",
+    "list_reservations": "30/min",
+    "create_reservation": "10/min",
+    "delete_reservation": "20/min",
+    "create_order": "5/min",
+    "create_hour_order": "5/min",
+}
+API_THROTTLE_CACHE = "default"
+
+TESTING = sys.argv[1:2] == ["test"]
+
+# Cache shared by all workers (throttle buckets, idempotency keys, slow queries, the staff summary): a local
+# Redis server at CACHE_URL. Required outside DEBUG; the per-process locmem fallback is for development and
+# tests only, and the `api.W001` system check warns about it.
+if os.getenv("CACHE_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("CACHE_URL"),  # e.g. redis://127.0.0.1:6379/1
+        }
+    }
+elif DEBUG or TESTING:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+else:
+    raise ImproperlyConfigured("CACHE_URL must point to the shared cache server (e.g. redis://127.0.0.1:6379/1).")
+
+# `?since=` sync tokens are back-dated by this many seconds, so writes that set `updated_at` before a
+# concurrent reservation list query but commit after it are still in the next delta (longer than any transaction)
+SYNC_TOKEN_SAFETY_MARGIN = 30
+
+# How long items claimed from the staff work queues stay leased to one admin
+WORK_QUEUE_LEASE_SECONDS = 10 * 60
+
+# Students' ICS calendar feeds up to this size are cached until their reservations change (see api/calendar_feed.py)
+CALENDAR_FEED_CACHE_MAX_BYTES = 512 * 1024
+
+# Student notifications are coalesced per student for this many seconds, then sent as one digest email
+# by the `flush_notifications` command in batches of NOTIFICATION_BATCH_SIZE (see api/notifications.py)
+NOTIFICATION_DIGEST_WINDOW = int(os.getenv("NOTIFICATION_DIGEST_WINDOW", "300"))
+NOTIFICATION_BATCH_SIZE = 100
+
+# Sampled cProfile profiling of API views and admin actions (see api/profiling.py)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED") == "1"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))  # Fraction of matching requests
+PROFILING_TARGETS = [name for name in os.getenv("PROFILING_TARGETS", "").split(",") if name]  # URL or admin action names
+PROFILING_USER_IDS = [user_id for user_id in os.getenv("PROFILING_USER_IDS", "").split(",") if user_id]
+PROFILING_HEADER = "X-Profile"  # Always profiles a request sending this header with PROFILING_TOKEN
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_DIR = BASE_DIR / "profiles"
+PROFILING_MAX_FILES = 200
+
+# Capture of queries slower than the threshold, with sampled EXPLAIN plans (see api/slowqueries.py)
+SLOW_QUERY_ENABLED = os.getenv("SLOW_QUERY_ENABLED") == "1"
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1"))  # Fraction of slow SELECTs explained
+SLOW_QUERY_BUFFER_SIZE = 500  # Most recent slow queries kept (shared by all workers through the cache)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api": {"handlers": ["console"], "level": os.getenv("API_LOG_LEVEL", "INFO")},
+    },
 }
 
 
@@ -51,6 +134,15 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
+# How long `/api/session/` trusts a cached user check (active flag) before reading the user again
+SESSION_USER_CACHE_TIMEOUT = 60
+
+# Stored responses for `Idempotency-Key` retries are replayed for this many seconds
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# A claimed key whose first request has not finished after this many seconds (worker killed mid-view)
+# is taken over by the next retry instead of answering 409 until the TTL ends
+IDEMPOTENCY_PROCESSING_TIMEOUT = 60
+
 
 # Application definition
 
@@ -69,11 +161,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.slowqueries.SlowQueryMiddleware',  # No-op unless SLOW_QUERY_ENABLED; outermost to see session queries too
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'api.profiling.ProfilingMiddleware',  # No-op unless PROFILING_ENABLED
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "corsheaders.middleware.CorsMiddleware",
 ]
@@ -161,4 +255,6 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
+CORS_EXPOSE_HEADERS = ["X-Sync-Token"]
 CORS_ALLOWS_CREDENTIALS = True
\ No newline at end of file
@@ -2,7 +2,7 @@
 
 '''
 Defines URL routing for the Django application:
-1. Admin panel access for application management.
+1. Admin panel access for application management, including the staff slow-query page.
 2. User registration and JWT-based authentication (with token refresh).
 3. API endpoints for app-specific functionalities via `api` routes.
 
@@ -11,10 +11,12 @@ These routes structure the application to handle admin tasks, authentication, an
 
 from django.contrib import admin
 from django.urls import path, include
+from api.admin import slow_queries_view
 from api.views import CreateUserView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
+    path("admin/slow-queries/", admin.site.admin_view(slow_queries_view), name="slow_queries_admin"),  # Staff only
     path("admin/", admin.site.urls),  # Admin panel for managing the application
     path("api/user/register/", CreateUserView.as_view(), name="register"),  # Endpoint for user registration
     path("api/token/", TokenObtainPairView.as_view(), name="get_token"),  # Endpoint for obtaining JWT token
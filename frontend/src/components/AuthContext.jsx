@@ -5,6 +5,8 @@ Manages user authentication, token handling, and order status:
 1. AuthProvider: Provides authentication state, username tracking, and order status (completed/pending) across the app.
 2. Login & Logout: Handles token storage, user session management, and tracks login events.
 3. Token Handling: Validates and refreshes access tokens, with periodic auto-refresh every 5 minutes.
+   Login and refresh both go through `/api/session/`, which returns the new tokens, tracks the login
+   and returns the order status in a single request.
 4. Order Status: Fetches and updates the status of user orders (completed or pending) from the server.
 5. Context Integration: Exposes authentication and order state via the AuthContext for use throughout the application.
 
@@ -57,6 +59,21 @@ export const AuthProvider = ({ children }) => {
   };
   
   
+  // Refreshes the tokens, tracks the login and loads the order status in one request
+  const startSession = async (refreshToken) => {
+    const res = await api.post("/api/session/", { refresh: refreshToken });
+    localStorage.setItem(ACCESS_TOKEN, res.data.access);
+    if (res.data.refresh) {
+      localStorage.setItem(REFRESH_TOKEN, res.data.refresh);  // Rotated refresh token
+    }
+    localStorage.setItem("USERNAME", res.data.username);
+    setIsAuthenticated(true);
+    setUsername(res.data.username);
+    setOrderCompleted(res.data.order_completed);
+    // If there is an approved order, we ignore "pending"
+    setOrderPending(res.data.order_pending && !res.data.order_completed);
+  };
+
   // Handles user login: sets authentication state, stores tokens, and tracks login
   const login = async (username, accessToken, refreshToken) => {
     setIsAuthenticated(true);
@@ -64,13 +81,12 @@ export const AuthProvider = ({ children }) => {
     localStorage.setItem("USERNAME", username);
     localStorage.setItem(ACCESS_TOKEN, accessToken);  
     localStorage.setItem(REFRESH_TOKEN, refreshToken);  
-    await fetchOrderStatus();
 
     try {
-      const res = await api.post("/api/user/login/track/");
-      fetchOrderStatus();
+      await startSession(refreshToken);
     } catch (error) {
-      console.error("Failed to track login:", error);
+      console.error("Failed to start session:", error);
+      fetchOrderStatus();
     }
   };
 
@@ -104,15 +120,7 @@ export const AuthProvider = ({ children }) => {
     }
 
     try {
-      const res = await api.post("/api/token/refresh/", { refresh: refreshToken });
-      if (res.status === 200 && res.data.access) {
-        localStorage.setItem(ACCESS_TOKEN, res.data.access);
-        setIsAuthenticated(true);
-        setUsername(localStorage.getItem("USERNAME"));
-        fetchOrderStatus();
-      } else {
-        logout();
-      }
+      await startSession(refreshToken);
     } catch (error) {
       console.log("Error during token refresh:", error);
       logout();
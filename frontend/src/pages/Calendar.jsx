@@ -3,18 +3,20 @@
 /*
 Calendar page for managing lesson reservations with responsive design:
 1. Displays available study hours and remaining hours dynamically after accounting for pending reservations.
-2. Loads reservations with status-based color coding: green (approved), orange (pending), red (rejected).
+2. Loads reservations with status-based color coding: green (approved), orange (pending), red (rejected), gray (expired),
+   fetching only the changes since the last sync after the initial load.
 3. Allows users to:
    - Reserve lessons for future dates only.
    - Delete pending reservations.
    - Order additional study hours if depleted.
 4. Automatically adjusts the calendar view for smaller screens (day view) and larger screens (week view).
 5. Provides a manual for user guidance and functionality to clear rejected reservations.
+6. Shows the link to subscribe to the lessons from a calendar app (ICS feed).
 
 This component enables seamless scheduling of lessons with a responsive and user-friendly calendar interface.
 */
 
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import FullCalendar from "@fullcalendar/react";
 import dayGridPlugin from "@fullcalendar/daygrid";
 import timeGridPlugin from "@fullcalendar/timegrid";
@@ -31,7 +33,9 @@ function Calendar() {
   const [showOrderForm, setShowOrderForm] = useState(false);
   const [manualVisible, setManualVisible] = useState(false);
   const [hasRejectedEvents, setHasRejectedEvents] = useState(false);
+  const [feedUrl, setFeedUrl] = useState(null);
   const [initialView, setInitialView] = useState(window.innerWidth < 768 ? "timeGridDay" : "timeGridWeek");
+  const syncToken = useRef(null); // Token of the last reservation sync, used to fetch only changes
 
   useEffect(() => {
     fetchStudyHours();
@@ -74,36 +78,54 @@ function Calendar() {
     }
   };
 
-  // Fetch all reservations (events) and update the calendar
+  // Convert a reservation from the API into a calendar event
+  const toEvent = (res) => ({
+    id: res.id,
+    title:
+      res.status === "pending"
+        ? "Pending"
+        : res.status === "approved"
+        ? "Approved"
+        : res.status === "expired"
+        ? "Expired"
+        : "Rejected",
+    start: res.start_time,
+    end: res.end_time,
+    color:
+      res.status === "pending"
+        ? "orange"
+        : res.status === "approved"
+        ? "green"
+        : res.status === "expired"
+        ? "gray"
+        : "red",
+    status: res.status,
+  });
+
+  // Fetch reservations and update the calendar; after the first load only the changes since the last sync are fetched
   const loadEvents = async () => {
     try {
-      const { data } = await api.get("/api/reservations/");
-      const parsedEvents = data.map((res) => ({
-        id: res.id,
-        title:
-          res.status === "pending"
-            ? "Pending"
-            : res.status === "approved"
-            ? "Approved"
-            : "Rejected",
-        start: res.start_time,
-        end: res.end_time,
-        color:
-          res.status === "pending"
-            ? "orange"
-            : res.status === "approved"
-            ? "green"
-            : "red",
-        status: res.status,
-      }));
-      setEvents(parsedEvents); // Update the state with the parsed events
-  
-      // Count pending reservations and dynamically calculate remaining study hours
-      const pendingReservationsCount = parsedEvents.filter(
-        (event) => event.status === "pending"
-      ).length;
-      setRemainingHours(Math.max(studyHours - pendingReservationsCount, 0)); // Dynamic update of Remaining Study Hours
-      setShowRemainingHours(pendingReservationsCount > 0); // Toggle visibility of "Remaining Study Hours" if there are pending reservations
+      if (syncToken.current) {
+        try {
+          const { data } = await api.get("/api/reservations/", { params: { since: syncToken.current } });
+          syncToken.current = data.token;
+          const changed = new Map(data.changed.map((res) => [res.id, toEvent(res)]));
+          const removed = new Set(data.removed);
+          if (changed.size > 0 || removed.size > 0) {
+            setEvents((prev) => [
+              ...prev.filter((event) => !changed.has(event.id) && !removed.has(event.id)),
+              ...changed.values(),
+            ]);
+          }
+          return;
+        } catch (error) {
+          if (error.response?.status !== 410) throw error; // 410: token too old, reload everything below
+        }
+      }
+
+      const response = await api.get("/api/reservations/");
+      syncToken.current = response.headers["x-sync-token"] || null;
+      setEvents(response.data.map(toEvent)); // Remaining study hours are recalculated by the effect on `events`
     } catch (error) {
       console.error("Failed to load events:", error);
     }
@@ -164,6 +186,16 @@ function Calendar() {
     }
   };
 
+  // Fetch the calendar subscription link; `rotate` issues a new one, so previously shared links stop working
+  const loadFeedUrl = async (rotate = false) => {
+    try {
+      const { data } = rotate ? await api.post("/api/calendar/token/") : await api.get("/api/calendar/token/");
+      setFeedUrl(data.webcal_url);
+    } catch (error) {
+      console.error("Failed to load calendar subscription link:", error);
+    }
+  };
+
   // Render content for each event displayed on the calendar
   const renderEventContent = (eventInfo) => (
     <div>
@@ -207,8 +239,25 @@ function Calendar() {
         <button className="btn btn-primary ml-2" onClick={() => setShowOrderForm(true)}>
           Order More Hours
         </button>
+        <button className="btn btn-secondary ml-2" onClick={() => loadFeedUrl()}>
+          Subscribe in Calendar App
+        </button>
       </div>
 
+      {feedUrl && (
+        <div className="text-center mb-4">
+          <p>
+            Add this link to your calendar app (Google Calendar, Outlook, Apple Calendar) to see your lessons there:
+          </p>
+          <a href={feedUrl}>{feedUrl}</a>
+          <div className="mt-2">
+            <button className="btn btn-outline-danger btn-sm" onClick={() => loadFeedUrl(true)}>
+              Create New Link
+            </button>
+          </div>
+        </div>
+      )}
+
       {manualVisible && (
         <div className="manual-overlay">
           <div className="manual-content">